@@ -1,11 +1,45 @@
-from . import file, modules, util
-from .orchestrator import Module, Orchestrator, module
+from typing import TYPE_CHECKING, Any
+
+from pasch.lazy import lazy_import
+
+# Everything is imported on first access, so a config only pays for the
+# modules it actually uses.
+if TYPE_CHECKING:
+    from . import file, fleet, modules, runner, store, transport, util
+    from .orchestrator import GenModule, Module, Orchestrator, module, module_gen
 
 __all__: list[str] = [
+    "GenModule",
     "Module",
     "Orchestrator",
     "file",
+    "fleet",
     "module",
+    "module_gen",
     "modules",
+    "runner",
+    "store",
+    "transport",
     "util",
 ]
+
+
+def __getattr__(name: str) -> Any:
+    return lazy_import(
+        __name__,
+        name,
+        {
+            "GenModule": ".orchestrator",
+            "Module": ".orchestrator",
+            "Orchestrator": ".orchestrator",
+            "file": ".file",
+            "fleet": ".fleet",
+            "module": ".orchestrator",
+            "module_gen": ".orchestrator",
+            "modules": ".modules",
+            "runner": ".runner",
+            "store": ".store",
+            "transport": ".transport",
+            "util": ".util",
+        },
+    )
@@ -0,0 +1,340 @@
+"""
+The `pasch` command.
+
+    pasch status [--json] [--full]      check for drift without changing anything
+    pasch diff                          show all pending changes in detail
+    pasch plan [-o FILE]                save the pending changes to apply later
+    pasch apply [--dry-run] [--force]   bring the system into the target state
+    pasch apply --plan FILE             apply a plan saved by `pasch plan`
+    pasch history                       list the generations of managed files
+    pasch rollback GENERATION           restore managed files from a generation
+
+The config is a python file defining `config(o: Orchestrator)`, which registers
+the modules on the orchestrator, the same as for `pasch.fleet`. All commands
+take `--only MODULE` to restrict them to some modules, for example to check
+files without querying pacman. The commands that plan changes also take
+`--paranoid` and `--jobs`, which override the settings of `Files` modules.
+
+Exit codes: 0 if the system is in its target state, 1 if it isn't (drift, or
+changes that were skipped), 2 for usage errors and 3 if pasch failed.
+"""
+
+from __future__ import annotations
+
+import contextlib
+import importlib.util
+import json
+import sys
+import traceback
+from argparse import ArgumentParser, Namespace
+from pathlib import Path
+from typing import TYPE_CHECKING, Any
+
+from rich.console import Console
+from rich.markup import escape
+from xdg_base_dirs import xdg_config_home
+
+from pasch.modules.files import Files
+from pasch.orchestrator import Orchestrator
+
+if TYPE_CHECKING:
+    from pasch.fleet import Config
+
+EXIT_OK = 0
+EXIT_DRIFT = 1
+EXIT_FAILURE = 3
+
+
+class UsageError(Exception):
+    """
+    Arguments that don't fit the config, reported like argparse's errors.
+    """
+
+
+def load_config(path: Path) -> Config:
+    spec = importlib.util.spec_from_file_location("pasch_config", path)
+    if spec is None or spec.loader is None:
+        raise Exception(f"can't load config from {path}")
+
+    module = importlib.util.module_from_spec(spec)
+    # Classes defined in the config, like dataclasses, look their module up
+    sys.modules[spec.name] = module
+    spec.loader.exec_module(module)
+
+    config = getattr(module, "config", None)
+    if not callable(config):
+        raise Exception(f"{path} doesn't define a config(o) function")
+    return config
+
+
+def _files_modules(o: Orchestrator) -> list[Files]:
+    return [m for m in o.selected().values() if isinstance(m, Files)]
+
+
+def _orchestrator(args: Namespace, **kwargs: Any) -> Orchestrator:
+    o = Orchestrator(name=args.name, only=args.only, **kwargs)
+    load_config(args.config)(o)
+    if unknown := o.unknown_modules():
+        raise UsageError(f"--only: unknown modules {', '.join(unknown)}")
+
+    # Options of the planning commands override the config
+    for files in _files_modules(o):
+        if getattr(args, "paranoid", False):
+            files.paranoid = True
+        if getattr(args, "jobs", None) is not None:
+            files.jobs = args.jobs
+    return o
+
+
+def _print_changes(c: Console, changes: dict[str, list[str]]) -> None:
+    for key, module_changes in changes.items():
+        if not module_changes:
+            c.print(f"{escape(key)}: [green]in sync")
+            continue
+        n = len(module_changes)
+        c.print(f"{escape(key)}: [yellow]{n} change{'' if n == 1 else 's'}")
+        for change in module_changes:
+            c.print(f"  {escape(change)}")
+
+
+def cmd_status(args: Namespace, c: Console) -> int:
+    o = _orchestrator(args, dry_run=True, interactive=False)
+    o.c.quiet = True
+
+    # Keep stdout clean for the report, commands run by modules still print
+    changes: dict[str, list[str]] = {}
+    with contextlib.redirect_stdout(sys.stderr):
+        o.configure()
+        # Modules that didn't change since they last ran successfully don't
+        # need to be planned
+        outdated = None if args.full else o.outdated()
+        up_to_date = outdated == []
+        if not up_to_date:
+            plan = o.plan(outdated)
+            modules = o.module_keys()
+            changes = {k: modules[k].changes(p) for k, p in plan.modules.items()}
+
+    in_sync = not any(changes.values())
+    if args.json:
+        report = {
+            "in_sync": in_sync,
+            "up_to_date": up_to_date,
+            "modules": {
+                key: {"in_sync": not module_changes, "changes": module_changes}
+                for key, module_changes in changes.items()
+            },
+        }
+        c.out(json.dumps(report, indent=2), highlight=False)
+    elif up_to_date:
+        c.print("[green]Up to date[/] since the last successful run")
+    else:
+        _print_changes(c, changes)
+
+    return EXIT_OK if in_sync else EXIT_DRIFT
+
+
+def cmd_diff(args: Namespace, c: Console) -> int:
+    o = _orchestrator(args, dry_run=True, interactive=False)
+    o.c.quiet = True
+    with contextlib.redirect_stdout(sys.stderr):
+        o.configure()
+        plan = o.plan()
+    o.c.quiet = False
+
+    modules = o.module_keys()
+    drift = False
+    for key, module_plan in plan.modules.items():
+        module = modules[key]
+        if not module.changes(module_plan):
+            continue
+        drift = True
+        c.print(f"[bold bright_magenta]\\[{escape(key)}]")
+        module.diff(module_plan)
+
+    return EXIT_DRIFT if drift else EXIT_OK
+
+
+def cmd_plan(args: Namespace, c: Console) -> int:
+    # Planning doesn't change anything, the plan is only applied later
+    o = _orchestrator(args, dry_run=True, interactive=False)
+    o.c.quiet = True
+    with contextlib.redirect_stdout(sys.stderr):
+        o.force = args.force
+        o.configure()
+        plan = o.plan(None if args.force else o.outdated())
+    path = o.save_plan(plan, args.output)
+
+    modules = o.module_keys()
+    changes = {k: modules[k].changes(p) for k, p in plan.modules.items()}
+    _print_changes(c, changes)
+    c.print(f"Plan written to {escape(str(path))}")
+    return EXIT_DRIFT if any(changes.values()) else EXIT_OK
+
+
+def cmd_apply(args: Namespace, c: Console) -> int:
+    o = _orchestrator(
+        args,
+        dry_run=args.dry_run,
+        jobs=args.jobs or 1,
+        profile=args.profile,
+        interactive=not args.non_interactive,
+    )
+    if args.plan is not None:
+        o.apply(args.plan)
+    else:
+        o.realize(force=args.force)
+    return EXIT_OK if o.converged() else EXIT_DRIFT
+
+
+def cmd_history(args: Namespace, c: Console) -> int:
+    o = _orchestrator(args)
+    for files in _files_modules(o):
+        key = next(k for k, m in o.module_keys().items() if m is files)
+        c.print(f"[bold bright_magenta]\\[{escape(key)}]")
+        for gen in files.generations():
+            c.print(
+                f"{gen.id:>4}  {escape(gen.time)}  {len(gen.files)} files, "
+                f"{len(gen.previous)} changed"
+            )
+    return EXIT_OK
+
+
+def cmd_rollback(args: Namespace, c: Console) -> int:
+    o = _orchestrator(args, dry_run=args.dry_run, interactive=not args.non_interactive)
+    modules = _files_modules(o)
+    if len(modules) != 1:
+        raise UsageError("select exactly one Files module with --only")
+
+    c.print(f"[bold bright_cyan]# Rollback to generation {args.generation}")
+    modules[0].rollback(args.generation)
+    return EXIT_OK if modules[0].converged() else EXIT_DRIFT
+
+
+def parser() -> ArgumentParser:
+    common = ArgumentParser(add_help=False)
+    common.add_argument(
+        "-c",
+        "--config",
+        type=Path,
+        default=xdg_config_home() / "pasch" / "config.py",
+        help="python file defining config(o) (default: %(default)s)",
+    )
+    common.add_argument(
+        "--name", default="pasch", help="name of the state dir (default: pasch)"
+    )
+    common.add_argument(
+        "--only",
+        action="append",
+        metavar="MODULE",
+        help="only handle this module, by key or class name (repeatable)",
+    )
+
+    # Options for the commands that plan changes
+    planning = ArgumentParser(add_help=False)
+    planning.add_argument(
+        "--paranoid",
+        action="store_true",
+        help="render and hash all files instead of trusting recorded stats",
+    )
+    planning.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        help="number of modules and files to handle concurrently",
+    )
+
+    parser = ArgumentParser(
+        prog="pasch", description="Python-based Arch System Config Helper"
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    status = commands.add_parser(
+        "status", parents=[common, planning], help="check whether the system drifted"
+    )
+    status.add_argument("--json", action="store_true", help="print a json report")
+    status.add_argument(
+        "--full",
+        action="store_true",
+        help="also check modules that didn't change since they last ran",
+    )
+    status.set_defaults(func=cmd_status)
+
+    diff = commands.add_parser(
+        "diff", parents=[common, planning], help="show pending changes"
+    )
+    diff.set_defaults(func=cmd_diff)
+
+    force_help = "reconcile everything, including what didn't change since the last run"
+
+    plan = commands.add_parser(
+        "plan", parents=[common, planning], help="save pending changes to apply later"
+    )
+    plan.add_argument(
+        "-o",
+        "--output",
+        type=Path,
+        help="where to write the plan (default: plan.json in the state dir)",
+    )
+    plan.add_argument("-f", "--force", action="store_true", help=force_help)
+    plan.set_defaults(func=cmd_plan)
+
+    apply = commands.add_parser(
+        "apply",
+        parents=[common, planning],
+        help="bring the system into the target state",
+    )
+    apply.add_argument("-d", "--dry-run", action="store_true")
+    source = apply.add_mutually_exclusive_group()
+    source.add_argument("-f", "--force", action="store_true", help=force_help)
+    source.add_argument(
+        "--plan",
+        type=Path,
+        metavar="FILE",
+        help="apply a plan saved by `pasch plan` instead of planning again",
+    )
+    apply.add_argument("--profile", action="store_true")
+    apply.add_argument(
+        "-n",
+        "--non-interactive",
+        action="store_true",
+        help="never ask, skip changes that need confirmation instead",
+    )
+    apply.set_defaults(func=cmd_apply)
+
+    history = commands.add_parser(
+        "history", parents=[common], help="list generations of managed files"
+    )
+    history.set_defaults(func=cmd_history)
+
+    rollback = commands.add_parser(
+        "rollback", parents=[common], help="restore managed files from a generation"
+    )
+    rollback.add_argument("generation", type=int)
+    rollback.add_argument("-d", "--dry-run", action="store_true")
+    rollback.add_argument(
+        "-n",
+        "--non-interactive",
+        action="store_true",
+        help="never ask, skip changes that need confirmation instead",
+    )
+    rollback.set_defaults(func=cmd_rollback)
+
+    return parser
+
+
+def main() -> None:
+    arg_parser = parser()
+    args = arg_parser.parse_args()
+    c = Console(highlight=False)
+    try:
+        code = args.func(args, c)
+    except UsageError as e:
+        arg_parser.error(str(e))
+    except Exception:
+        Console(stderr=True).print(escape(traceback.format_exc().rstrip()))
+        code = EXIT_FAILURE
+    sys.exit(code)
+
+
+if __name__ == "__main__":
+    main()
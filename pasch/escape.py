@@ -0,0 +1,31 @@
+import re
+from collections.abc import Callable
+
+
+def escaper(escapes: dict[str, str]) -> Callable[[str], str]:
+    """
+    Build a function that replaces every character in `escapes` by its escape
+    sequence. The replacements are applied in order, so the escape character
+    itself (usually `\\`) has to come first.
+    """
+    # A chain of `str.replace` is considerably faster than `str.translate`
+    # with multi-character replacements, and returns the string unchanged,
+    # without copying it, if there is nothing to escape.
+    pairs = tuple(escapes.items())
+    for i, (_, new) in enumerate(pairs):
+        assert not any(old in new for old, _ in pairs[i + 1 :])
+
+    def escape(s: str) -> str:
+        for old, new in pairs:
+            s = s.replace(old, new)
+        return s
+
+    return escape
+
+
+def matcher(pattern: str) -> Callable[[str], bool]:
+    """
+    Build a function that checks if a whole string matches `pattern`.
+    """
+    fullmatch = re.compile(pattern).fullmatch
+    return lambda s: fullmatch(s) is not None
@@ -1,9 +1,15 @@
-from .binary import BinaryFile
-from .file import TAG, File
-from .git import GitFile
-from .json import JsonFile
-from .text import TextFile
-from .toml import TomlFile
+from typing import TYPE_CHECKING, Any
+
+from pasch.lazy import lazy_import
+
+if TYPE_CHECKING:
+    from .binary import BinaryFile
+    from .file import TAG, File
+    from .git import GitFile
+    from .json import JsonFile
+    from .source import SourceFile
+    from .text import TextFile
+    from .toml import TomlFile
 
 __all__: list[str] = [
     "TAG",
@@ -11,6 +17,24 @@ __all__: list[str] = [
     "File",
     "GitFile",
     "JsonFile",
+    "SourceFile",
     "TextFile",
     "TomlFile",
 ]
+
+
+def __getattr__(name: str) -> Any:
+    return lazy_import(
+        __name__,
+        name,
+        {
+            "TAG": ".file",
+            "BinaryFile": ".binary",
+            "File": ".file",
+            "GitFile": ".git",
+            "JsonFile": ".json",
+            "SourceFile": ".source",
+            "TextFile": ".text",
+            "TomlFile": ".toml",
+        },
+    )
@@ -1,10 +1,80 @@
+import hashlib
 from abc import ABC, abstractmethod
+from collections.abc import Iterator
+from pathlib import Path
+
+from pasch.profile import count
 
 TAG = "This file was generated by pasch."
 
 
+def hash_bytes(data: bytes) -> str:
+    return f"sha256-{hashlib.sha256(data).hexdigest()}"
+
+
+def fingerprint(*parts: object) -> str:
+    """
+    Fingerprint the inputs a file is rendered from.
+
+    Only safe for parts with a deterministic `repr()`, like the builtin
+    containers and scalars most file types store their data as.
+    """
+    return hash_bytes(repr(parts).encode("utf-8"))
+
+
 class File(ABC):
     executable: bool = False
 
+    # Bump this whenever the serialization of a file type changes, so
+    # fingerprints from older versions are no longer considered valid.
+    fingerprint_version: int = 1
+
+    _rendered: bytes | None = None
+    _digest: str | None = None
+
     @abstractmethod
     def to_bytes(self) -> bytes: ...
+
+    def fingerprint(self) -> str | None:
+        """
+        A fingerprint of the data the file is rendered from, or `None` if
+        computing one is not cheaper than just rendering the file.
+
+        Two files with the same fingerprint must render to the same bytes.
+        """
+        return None
+
+    def source(self) -> Path | None:
+        """
+        An existing file with the same contents, if there is one. Such files
+        can be copied without passing their contents through python.
+        """
+        return None
+
+    def chunks(self) -> Iterator[bytes]:
+        """
+        The rendered contents in chunks. Override this to avoid keeping large
+        contents in memory all at once.
+        """
+        yield self.render()
+
+    def invalidate(self) -> None:
+        """
+        Forget the cached rendered contents. Must be called after mutating the
+        file's data by any means other than its methods.
+        """
+        self._rendered = None
+        self._digest = None
+
+    def render(self) -> bytes:
+        if self._rendered is None:
+            self._rendered = self.to_bytes()
+            count("file.rendered_bytes", len(self._rendered))
+        return self._rendered
+
+    def digest(self) -> str:
+        if self._digest is None:
+            data = self.render()
+            self._digest = hash_bytes(data)
+            count("file.hashed_bytes", len(data))
+        return self._digest
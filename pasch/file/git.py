@@ -1,9 +1,18 @@
-from .file import File
+from pasch.escape import escaper, matcher
+
+from .file import File, fingerprint
 from .text import TextFile
 
 type GitSection = str | tuple[str, str]
 type GitValue = bool | int | str
 
+_is_section_name = matcher(r"[A-Za-z0-9-]+")
+_is_variable_name = matcher(r"[A-Za-z][A-Za-z0-9-]*")
+_escape_subsection = escaper({"\\": "\\\\", '"': '\\"'})
+_escape_value = escaper(
+    {"\\": "\\\\", '"': '\\"', "\n": "\\n", "\t": "\\t", "\b": "\\b"}
+)
+
 
 def _format_header(section: GitSection) -> str:
     if isinstance(section, str):
@@ -14,8 +23,7 @@ def _format_header(section: GitSection) -> str:
     # Section names are case-insensitive. Only alphanumeric characters, `-` and
     # `.` are allowed in section names. However, the `[section.subsection]`
     # syntax is deprecated, so we don't allow `.` in section names.
-    assert title
-    assert all(c.isascii() and (c.isalnum() or c == "-") for c in title)
+    assert _is_section_name(title)
     section = title.lower()
 
     if subsection is None:
@@ -25,19 +33,15 @@ def _format_header(section: GitSection) -> str:
     # except newline and the null byte. Doublequote `"` and backslash can
     # be included by escaping them as `\"` and `\\`, respectively.
     assert subsection
-    for c in subsection:
-        assert c not in {"\n", "\0"}
+    assert "\n" not in subsection and "\0" not in subsection
 
-    escaped = "".join({'"': '\\"', "\\": "\\\\"}.get(c, c) for c in subsection)
-    return f'[{section} "{escaped}"]'
+    return f'[{section} "{_escape_subsection(subsection)}"]'
 
 
 def _format_name(name: str) -> str:
     # The variable names are case-insensitive, allow only alphanumeric
     # characters and `-`, and must start with an alphabetic character.
-    assert name
-    assert all(c.isascii() and (c.isalnum() or c == "-") for c in name)
-    assert name[0].isalpha()
+    assert _is_variable_name(name)
 
     return name
 
@@ -58,9 +62,7 @@ def _format_value(value: GitValue) -> str:
     # for newline character (NL), `\t` for horizontal tabulation (HT, TAB) and
     # `\b` for backspace (BS). Other char escape sequences (including octal
     # escape sequences) are invalid.
-    escapes = {'"': '\\"', "\\": "\\\\", "\n": "\\n", "\t": "\\t", "\b": "\\b"}
-    escaped = "".join(escapes.get(c, c) for c in value)
-    return f'"{escaped}"'
+    return f'"{_escape_value(value)}"'
 
 
 class GitFile(File):
@@ -75,13 +77,17 @@ class GitFile(File):
 
     def set(self, section: GitSection, name: str, value: GitValue) -> None:
         self.data.setdefault(section, {})[name] = value
+        self.invalidate()
+
+    def fingerprint(self) -> str | None:
+        return fingerprint(type(self).__name__, self.fingerprint_version, self.data)
 
     def to_text(self) -> TextFile:
         file = TextFile()
 
-        for section, values in sorted(self.data.items()):
+        for i, (section, values) in enumerate(sorted(self.data.items())):
             # Separate sections with an empty line
-            if file.data:
+            if i > 0:
                 file.append("")
 
             file.append(_format_header(section))
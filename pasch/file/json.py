@@ -1,26 +1,92 @@
 import json
+import sys
 from dataclasses import dataclass
 from typing import Any, Self
 
-from .file import TAG, File
+from .file import TAG, File, fingerprint
 from .text import TextFile
 
 
-def _merge_values(a: Any, b: Any) -> Any:
-    if not isinstance(a, dict) or not isinstance(b, dict):
-        return b
+@dataclass(frozen=True)
+class JsonLayer:
+    """
+    A single `set` or `merge` on a `JsonFile`, and the location of the code
+    that made it.
+    """
 
-    result = {}
-    for k, v_a in a.items():
-        result[k] = v_a
-    for k, v_b in b.items():
-        v_a = a.get(k)
-        if v_a is None:
-            result[k] = v_b
-        else:
-            result[k] = _merge_values(v_a, v_b)
-
-    return result
+    path: tuple[str, ...]
+    value: Any
+    merge: bool
+    origin: str
+
+
+def _origin() -> str:
+    # The first caller outside of the file types, like a config function
+    frame = sys._getframe(1)
+    while frame.f_back is not None and frame.f_globals["__name__"].startswith(
+        "pasch.file"
+    ):
+        frame = frame.f_back
+    return f"{frame.f_code.co_filename}:{frame.f_lineno}"
+
+
+def _lookup(value: Any, path: tuple[str, ...]) -> tuple[bool, Any]:
+    for part in path:
+        if not isinstance(value, dict) or part not in value:
+            return False, None
+        value = value[part]
+    return True, value
+
+
+def _materialize(data: Any, layers: list[JsonLayer]) -> Any:
+    """
+    Apply the layers to `data` without modifying it or any of the layer values.
+    Dicts are only copied when a layer writes into them, and at most once, so
+    everything else is shared with the previous data and the layer values.
+
+    Raises `TypeError` if a layer's path runs through a value that isn't a dict.
+    """
+    owned: dict[int, dict[str, Any]] = {}
+
+    def own(value: dict[str, Any]) -> dict[str, Any]:
+        if id(value) in owned:
+            return value
+        value = dict(value)
+        owned[id(value)] = value
+        return value
+
+    def own_at(node: Any, layer: JsonLayer, depth: int) -> dict[str, Any]:
+        # Missing dicts on the path are created, anything else is in the way
+        if not isinstance(node, dict):
+            path = ".".join(layer.path[:depth]) or "the root"
+            raise TypeError(
+                f"{layer.origin}: cannot set {'.'.join(layer.path)}, "
+                f"{path} has type {type(node).__name__}, not dict"
+            )
+        return own(node)
+
+    def merge(a: Any, b: Any) -> Any:
+        if not isinstance(a, dict) or not isinstance(b, dict):
+            return b
+        a = own(a)
+        for k, v in b.items():
+            a[k] = merge(a.get(k), v)
+        return a
+
+    for layer in layers:
+        if not layer.path:
+            data = merge(data, layer.value) if layer.merge else layer.value
+            continue
+
+        *parts, last = layer.path
+        data = node = own_at(data, layer, 0)
+        for depth, part in enumerate(parts, 1):
+            child = own_at(node.get(part, {}), layer, depth)
+            node[part] = child
+            node = child
+        node[last] = merge(node.get(last), layer.value) if layer.merge else layer.value
+
+    return data
 
 
 @dataclass
@@ -37,11 +103,23 @@ class JsonFileProxy:
 
         self.file.set(self.path + path, value)
 
+    def merge(self, path: str | tuple[str, ...], value: Any) -> None:
+        if isinstance(path, str):
+            path = (path,)
+
+        self.file.merge(self.path + path, value)
+
     def tag(self, path: str | tuple[str, ...] = "_tag") -> None:
         self.set(path, TAG)
 
 
 class JsonFile(File):
+    """
+    Sets and merges are recorded as layers and only applied when the data is
+    needed, usually once when the file is rendered. `blame` tells which layers
+    produced a value.
+    """
+
     def __init__(
         self,
         data: Any = None,
@@ -52,6 +130,20 @@ class JsonFile(File):
         self.indent = indent
         self.trailing_newline = trailing_newline
 
+    @property
+    def data(self) -> Any:
+        if self._pending:
+            self._data = _materialize(self._data, self._pending)
+            self._pending = []
+        return self._data
+
+    @data.setter
+    def data(self, value: Any) -> None:
+        self._data = value
+        self._pending: list[JsonLayer] = []
+        self.layers = [JsonLayer((), value, merge=False, origin=_origin())]
+        self.invalidate()
+
     def at(self, *path: str) -> JsonFileProxy:
         return JsonFileProxy(self, path)
 
@@ -61,27 +153,60 @@ class JsonFile(File):
             data = data[part]
         return data
 
-    def set(self, path: str | tuple[str, ...], value: Any) -> None:
+    def _add_layer(self, path: str | tuple[str, ...], value: Any, merge: bool) -> None:
         if isinstance(path, str):
             path = (path,)
 
-        if not path:
-            self.data = value
-            return
-
-        *parts, last = path
+        layer = JsonLayer(path, value, merge=merge, origin=_origin())
+        self._pending.append(layer)
+        self.layers.append(layer)
+        self.invalidate()
 
-        data = self.data
-        for part in parts:
-            data = data.setdefault(part, {})
-        data[last] = value
+    def set(self, path: str | tuple[str, ...], value: Any) -> None:
+        self._add_layer(path, value, merge=False)
 
     def merge(self, path: str | tuple[str, ...], value: Any) -> None:
-        self.set(path, _merge_values(self.get(path), value))
+        """
+        Recursively merge the dict `value` into the one at `path`. Anything
+        else, including a missing value, is replaced.
+        """
+        self._add_layer(path, value, merge=True)
+
+    def blame(self, path: str | tuple[str, ...]) -> list[JsonLayer]:
+        """
+        The layers that contributed to the value at `path`, oldest first. Layers
+        before the last one that replaced the value as a whole are left out.
+        """
+        if isinstance(path, str):
+            path = (path,)
+
+        result = []
+        for layer in self.layers:
+            if path[: len(layer.path)] == layer.path:
+                found, value = _lookup(layer.value, path[len(layer.path) :])
+                if not layer.merge:
+                    result = [layer] if found else []
+                elif found and isinstance(value, dict):
+                    result.append(layer)
+                elif found:
+                    result = [layer]
+            elif layer.path[: len(path)] == path:
+                # The layer changed something inside the value
+                result.append(layer)
+        return result
 
     def tag(self, path: str | tuple[str, ...] = "_tag") -> None:
         self.set(path, TAG)
 
+    def fingerprint(self) -> str | None:
+        return fingerprint(
+            type(self).__name__,
+            self.fingerprint_version,
+            self.indent,
+            self.trailing_newline,
+            self.data,
+        )
+
     def to_text(self) -> TextFile:
         file = TextFile()
         file.append(
@@ -0,0 +1,51 @@
+import hashlib
+from collections.abc import Iterator
+from pathlib import Path
+
+from pasch.profile import count
+
+from .file import File, fingerprint
+
+CHUNK_SIZE = 1024 * 1024
+
+
+class SourceFile(File):
+    """
+    A file whose contents are copied from an existing file, for example a font
+    or wallpaper stored next to the config.
+
+    Unlike a `BinaryFile`, the contents are never loaded into memory as a
+    whole. They are hashed and copied in chunks instead.
+    """
+
+    def __init__(self, path: Path | str, executable: bool = False) -> None:
+        self.path = Path(path)
+        self.executable = executable
+
+    def source(self) -> Path | None:
+        return self.path
+
+    def chunks(self) -> Iterator[bytes]:
+        with open(self.path, "rb") as f:
+            while chunk := f.read(CHUNK_SIZE):
+                yield chunk
+
+    def fingerprint(self) -> str | None:
+        stat = self.path.stat()
+        return fingerprint(
+            type(self).__name__,
+            self.fingerprint_version,
+            str(self.path.resolve()),
+            (stat.st_mtime_ns, stat.st_size, stat.st_ino),
+        )
+
+    def digest(self) -> str:
+        if self._digest is None:
+            with open(self.path, "rb") as f:
+                digest = hashlib.file_digest(f, "sha256").hexdigest()
+                count("file.hashed_bytes", f.tell())
+            self._digest = f"sha256-{digest}"
+        return self._digest
+
+    def to_bytes(self) -> bytes:
+        return self.path.read_bytes()
@@ -4,17 +4,36 @@ from .file import TAG, File
 
 class TextFile(File):
     def __init__(self, data: str = "") -> None:
-        self.data = data
+        # The contents are kept as a list of chunks and only joined on demand,
+        # so building a file line by line takes linear instead of quadratic
+        # time. Prepended chunks are stored in reverse order.
+        self._head: list[str] = []
+        self._tail: list[str] = [data]
+
+    @property
+    def data(self) -> str:
+        if self._head or len(self._tail) != 1:
+            self._tail = ["".join([*reversed(self._head), *self._tail])]
+            self._head = []
+        return self._tail[0]
+
+    @data.setter
+    def data(self, data: str) -> None:
+        self._head = []
+        self._tail = [data]
+        self.invalidate()
 
     def prepend(self, line: str, newline: bool = True) -> None:
         if newline:
             line = f"{line}\n"
-        self.data = line + self.data
+        self._head.append(line)
+        self.invalidate()
 
     def append(self, line: str, newline: bool = True) -> None:
         if newline:
             line = f"{line}\n"
-        self.data = self.data + line
+        self._tail.append(line)
+        self.invalidate()
 
     def tag(
         self,
@@ -1,13 +1,124 @@
+import datetime
+import math
+import re
+from collections.abc import Iterator
 from dataclasses import dataclass
 from typing import Any, Self
 
-import toml
+from pasch.escape import matcher
 
-from .file import File
-from .json import JsonFile
+from .file import File, fingerprint
+from .json import JsonFile, JsonLayer
 from .text import TextFile
 
 
+# https://toml.io/en/v1.0.0#string
+_STRING_ESCAPES = {
+    "\\": "\\\\",
+    '"': '\\"',
+    "\b": "\\b",
+    "\t": "\\t",
+    "\n": "\\n",
+    "\f": "\\f",
+    "\r": "\\r",
+}
+_needs_escape = re.compile(r'[\x00-\x1f\x7f"\\]')
+_is_bare_key = matcher(r"[A-Za-z0-9_-]+")
+
+
+def _escape_char(match: re.Match[str]) -> str:
+    c = match.group()
+    return _STRING_ESCAPES.get(c) or f"\\u{ord(c):04X}"
+
+
+def _format_string(s: str) -> str:
+    return f'"{_needs_escape.sub(_escape_char, s)}"'
+
+
+def _format_key(key: str) -> str:
+    return key if _is_bare_key(key) else _format_string(key)
+
+
+def _format_value(value: Any) -> str:
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if isinstance(value, int):
+        return str(value)
+    if isinstance(value, float):
+        if math.isnan(value):
+            return "nan"
+        if math.isinf(value):
+            return "inf" if value > 0 else "-inf"
+        return repr(value)
+    if isinstance(value, str):
+        return _format_string(value)
+    if isinstance(value, (datetime.datetime, datetime.date, datetime.time)):
+        return value.isoformat()
+    if isinstance(value, (list, tuple)):
+        return f"[{', '.join(_format_value(v) for v in value)}]"
+    if isinstance(value, dict):
+        # Inline tables can't omit keys, so `None` is not allowed here either
+        if not value:
+            return "{}"
+        items = ", ".join(
+            f"{_format_key(k)} = {_format_value(v)}" for k, v in sorted(value.items())
+        )
+        return f"{{ {items} }}"
+    raise ValueError(f"Cannot represent {value!r} in TOML")
+
+
+def _is_array_of_tables(value: Any) -> bool:
+    return (
+        isinstance(value, (list, tuple))
+        and len(value) > 0
+        and all(isinstance(v, dict) for v in value)
+    )
+
+
+def _table_lines(
+    table: dict[str, Any],
+    path: tuple[str, ...],
+    header: str | None,
+) -> Iterator[str]:
+    """
+    Yield the lines of a table and all of its sub-tables, sorted by key.
+    Values come before sub-tables and arrays of tables, as they would otherwise
+    belong to the previous table. `None` values are left out.
+    """
+    values = []
+    tables = []
+    for key, value in sorted(table.items()):
+        if value is None:
+            continue
+        if isinstance(value, dict) or _is_array_of_tables(value):
+            tables.append((key, value))
+        else:
+            values.append(f"{_format_key(key)} = {_format_value(value)}")
+
+    # Tables that only contain other tables are defined implicitly
+    if header is not None and (values or not tables):
+        yield header
+    yield from values
+
+    for key, value in tables:
+        sub_path = (*path, key)
+        name = ".".join(_format_key(k) for k in sub_path)
+        if isinstance(value, dict):
+            yield from _table_lines(value, sub_path, f"[{name}]")
+        else:
+            for item in value:
+                yield f"[[{name}]]"
+                yield from _table_lines(item, sub_path, None)
+
+
+def _toml_lines(data: dict[str, Any]) -> Iterator[str]:
+    # Separate tables with an empty line
+    for i, line in enumerate(_table_lines(data, (), None)):
+        if i > 0 and line.startswith("["):
+            yield ""
+        yield line
+
+
 @dataclass
 class TomlFileProxy:
     file: "TomlFile"
@@ -22,8 +133,17 @@ class TomlFileProxy:
 
         self.file.set(self.path + path, value)
 
+    def merge(self, path: str | tuple[str, ...], value: Any) -> None:
+        if isinstance(path, str):
+            path = (path,)
+
+        self.file.merge(self.path + path, value)
+
 
 class TomlFile(File):
+    # 2: Written by the built-in emitter instead of the `toml` package
+    fingerprint_version = 2
+
     def __init__(self, data: Any = {}) -> None:
         self.json = JsonFile(data)
 
@@ -35,14 +155,25 @@ class TomlFile(File):
 
     def set(self, path: str | tuple[str, ...], value: Any) -> None:
         self.json.set(path, value)
+        self.invalidate()
 
     def merge(self, path: str | tuple[str, ...], value: Any) -> None:
         self.json.merge(path, value)
+        self.invalidate()
+
+    def blame(self, path: str | tuple[str, ...]) -> list[JsonLayer]:
+        return self.json.blame(path)
+
+    def fingerprint(self) -> str | None:
+        return fingerprint(
+            type(self).__name__, self.fingerprint_version, self.json.data
+        )
 
     def to_text(self) -> TextFile:
         file = TextFile()
         file.tag(comment="#")
-        file.append(toml.dumps(self.json.data), newline=False)
+        for line in _toml_lines(self.json.data):
+            file.append(line)
         return file
 
     def to_bytes(self) -> bytes:
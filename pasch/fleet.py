@@ -0,0 +1,296 @@
+import contextlib
+import io
+import traceback
+from collections.abc import Callable
+from concurrent.futures import Future, ProcessPoolExecutor, as_completed
+from dataclasses import dataclass, field
+from pathlib import Path
+
+from rich.console import Console
+from rich.markup import escape
+from rich.table import Table
+from xdg_base_dirs import xdg_state_home
+
+from pasch.modules.files import Files
+from pasch.orchestrator import Orchestrator, Plan
+from pasch.store import ObjectStore
+from pasch.transport import LocalTransport, Transport
+from pasch.util import grouped_output, output_group
+
+# Registers the modules for a host on the orchestrator. It is called in worker
+# processes, so it must be a module-level function.
+type Config = Callable[[Orchestrator], None]
+
+
+@dataclass
+class Host:
+    name: str
+    transport: Transport = field(default_factory=LocalTransport)
+    # The user whose configuration is managed, defaults to the current user
+    user: str | None = None
+
+
+@dataclass
+class HostPlan:
+    host: str
+    plan: Plan | None
+    artifacts: dict[str, bytes]
+    output: str
+    error: str | None = None
+    # The hashes of the artifacts once they have been moved into the store
+    hashes: set[str] = field(default_factory=set)
+
+
+@dataclass
+class HostResult:
+    host: str
+    converged: bool
+    output: str
+    error: str | None = None
+
+
+def _orchestrator(
+    name: str,
+    host: Host,
+    state_dir: Path,
+    dry_run: bool,
+) -> Orchestrator:
+    return Orchestrator(
+        name=name,
+        dry_run=dry_run,
+        host=host.name,
+        user=host.user,
+        transport=host.transport,
+        state_dir=state_dir / "hosts" / host.name,
+        interactive=False,
+    )
+
+
+def _capture[T](func: Callable[[], T]) -> tuple[T | None, str, str | None]:
+    """
+    Call `func` with all output captured, including that of commands. Returns
+    its result, the output and the traceback if it raised an exception.
+    """
+    output = io.StringIO()
+    result = None
+    error = None
+    with contextlib.redirect_stdout(output), grouped_output(), output_group():
+        try:
+            result = func()
+        except Exception:
+            error = traceback.format_exc()
+    return result, output.getvalue(), error
+
+
+def _plan_host(name: str, config: Config, host: Host, state_dir: Path) -> HostPlan:
+    def plan() -> tuple[Plan, dict[str, bytes]]:
+        o = _orchestrator(name, host, state_dir, dry_run=True)
+        config(o)
+        o.configure()
+        plan = o.plan()
+
+        artifacts = {}
+        for key, module in o.module_keys().items():
+            if isinstance(module, Files) and key in plan.modules:
+                artifacts.update(module.artifacts(plan.modules[key]))
+        return plan, artifacts
+
+    result, output, error = _capture(plan)
+    if result is None:
+        return HostPlan(host.name, None, {}, output, error)
+    return HostPlan(host.name, result[0], result[1], output)
+
+
+def _apply_host(
+    name: str,
+    config: Config,
+    host: Host,
+    state_dir: Path,
+    plan: Plan,
+    dry_run: bool,
+) -> HostResult:
+    def apply() -> bool:
+        o = _orchestrator(name, host, state_dir, dry_run)
+        o.artifacts = ObjectStore(state_dir / "objects")
+        config(o)
+        o.configure()
+        o.apply_plan(plan)
+        return o.converged()
+
+    converged, output, error = _capture(apply)
+    return HostResult(host.name, bool(converged), output, error)
+
+
+class Fleet:
+    """
+    Realizes one config on many hosts in parallel.
+
+    The config is evaluated and planned for every host in worker processes.
+    Files to write are rendered once while planning and stored by their
+    content hash, so hosts sharing a file share its artifact. The plans are
+    then applied concurrently, again in worker processes, over each host's
+    transport.
+
+    Artifacts are removed from the store once their plans have been applied.
+    The state is kept in `state_dir`, which defaults to the XDG state directory.
+
+    Fleet runs are never interactive. Changes that would need confirmation are
+    skipped and the host is reported as not converged.
+    """
+
+    def __init__(
+        self,
+        config: Config,
+        hosts: list[Host],
+        name: str = "pasch",
+        jobs: int = 4,
+        dry_run: bool = False,
+        state_dir: Path | None = None,
+    ) -> None:
+        if len({host.name for host in hosts}) != len(hosts):
+            raise ValueError("host names must be unique")
+
+        self.config = config
+        self.hosts = hosts
+        self.name = name
+        self.jobs = jobs
+        self.dry_run = dry_run
+
+        self.state_dir = state_dir or xdg_state_home() / self.name / "fleet"
+        self.store = ObjectStore(self.state_dir / "objects")
+        self.c = Console(highlight=False)
+
+    def _progress(self, done: int, host: str, status: str) -> None:
+        width = len(str(len(self.hosts)))
+        progress = f"[{done:>{width}}/{len(self.hosts)}]"
+        self.c.print(f"[bright_black]{progress}[/] {escape(host)}: {status}")
+
+    def _print_output(self, host: str, output: str) -> None:
+        if output.strip():
+            self.c.print(f"[bold bright_magenta]\\[{escape(host)}]")
+            self.c.out(output.rstrip("\n"), highlight=False)
+
+    def plan(self) -> dict[str, HostPlan]:
+        self.c.print()
+        self.c.print("[bold bright_cyan]# Plan")
+
+        plans: dict[str, HostPlan] = {}
+        with ProcessPoolExecutor(max_workers=self.jobs) as executor:
+            futures = [
+                executor.submit(
+                    _plan_host, self.name, self.config, host, self.state_dir
+                )
+                for host in self.hosts
+            ]
+            for future in as_completed(futures):
+                result = future.result()
+                plans[result.host] = result
+                status = "[red]failed" if result.error else "planned"
+                self._progress(len(plans), result.host, status)
+
+        # Hosts often share files, which only need to be stored once
+        total = 0
+        unique = set()
+        for result in plans.values():
+            for hash, data in result.artifacts.items():
+                total += 1
+                if hash not in unique:
+                    self.store.put(data)
+                    unique.add(hash)
+            # The contents are in the store now, no need to keep them around
+            result.hashes = set(result.artifacts)
+            result.artifacts = {}
+        if total:
+            self.c.print(f"Stored {len(unique)} unique artifacts for {total} files")
+
+        # Artifacts of earlier plans that were never applied
+        self.store.remove(self.store.hashes() - unique)
+
+        return {host.name: plans[host.name] for host in self.hosts}
+
+    def apply(self, plans: dict[str, HostPlan]) -> dict[str, HostResult]:
+        self.c.print()
+        self.c.print("[bold bright_cyan]# Apply")
+
+        results: dict[str, HostResult] = {}
+        with ProcessPoolExecutor(max_workers=self.jobs) as executor:
+            futures: list[Future[HostResult]] = []
+            for host in self.hosts:
+                plan = plans[host.name].plan
+                if plan is None:
+                    continue
+                futures.append(
+                    executor.submit(
+                        _apply_host,
+                        self.name,
+                        self.config,
+                        host,
+                        self.state_dir,
+                        plan,
+                        self.dry_run,
+                    )
+                )
+            for future in as_completed(futures):
+                result = future.result()
+                results[result.host] = result
+                if result.error:
+                    status = "[red]failed"
+                elif not result.converged:
+                    status = "[yellow]not converged"
+                else:
+                    status = "done"
+                self._progress(len(results), result.host, status)
+
+        for host in self.hosts:
+            if host.name in results:
+                self._print_output(host.name, results[host.name].output)
+
+        # The plans have been applied, so their artifacts aren't needed anymore
+        self.store.remove(set().union(*(plan.hashes for plan in plans.values())))
+
+        return results
+
+    def print_summary(
+        self,
+        plans: dict[str, HostPlan],
+        results: dict[str, HostResult],
+    ) -> None:
+        table = Table("Host", "Status", "Error", title="Fleet")
+        for host in self.hosts:
+            plan = plans[host.name]
+            result = results.get(host.name)
+            if plan.error is not None:
+                status, error = "[red]plan failed", plan.error
+            elif result is None:
+                status, error = "[red]not applied", ""
+            elif result.error is not None:
+                status, error = "[red]apply failed", result.error
+            elif not result.converged:
+                status, error = "[yellow]not converged", ""
+            else:
+                status, error = "[green]ok", ""
+            # The last line of a traceback names the exception
+            lines = error.strip().splitlines()
+            table.add_row(escape(host.name), status, escape(lines[-1] if lines else ""))
+        self.c.print()
+        self.c.print(table)
+
+    def realize(self) -> bool:
+        """
+        Plan and apply the config on all hosts. Returns whether all hosts were
+        brought into their target state.
+        """
+        plans = self.plan()
+        for host in self.hosts:
+            plan = plans[host.name]
+            if plan.error is not None:
+                self._print_output(host.name, plan.output + plan.error)
+
+        results = self.apply(plans)
+        self.print_summary(plans, results)
+        return all(
+            host.name in results
+            and results[host.name].error is None
+            and results[host.name].converged
+            for host in self.hosts
+        )
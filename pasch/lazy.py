@@ -0,0 +1,19 @@
+import importlib
+import sys
+from typing import Any
+
+
+def lazy_import(package: str, name: str, exports: dict[str, str]) -> Any:
+    """
+    Implements a package's module `__getattr__` (PEP 562), so that its exports
+    are only imported on first access. `exports` maps each name to the
+    submodule defining it, relative to the package. A name that is the same as
+    its submodule exports the submodule itself.
+    """
+    if name not in exports:
+        raise AttributeError(f"module {package!r} has no attribute {name!r}")
+    module = importlib.import_module(exports[name], package)
+    value = module if exports[name] == f".{name}" else getattr(module, name)
+    # Later accesses find the name directly and don't go through `__getattr__`
+    setattr(sys.modules[package], name, value)
+    return value
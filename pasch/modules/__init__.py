@@ -1,8 +1,13 @@
-from .echo import Echo
-from .files import Files
-from .fish import Fish
-from .pacman import Pacman
-from .vscode import Vscode
+from typing import TYPE_CHECKING, Any
+
+from pasch.lazy import lazy_import
+
+if TYPE_CHECKING:
+    from .echo import Echo
+    from .files import Files
+    from .fish import Fish
+    from .pacman import Pacman
+    from .vscode import Vscode
 
 __all__: list[str] = [
     "Echo",
@@ -11,3 +16,17 @@ __all__: list[str] = [
     "Pacman",
     "Vscode",
 ]
+
+
+def __getattr__(name: str) -> Any:
+    return lazy_import(
+        __name__,
+        name,
+        {
+            "Echo": ".echo",
+            "Files": ".files",
+            "Fish": ".fish",
+            "Pacman": ".pacman",
+            "Vscode": ".vscode",
+        },
+    )
@@ -1,3 +1,6 @@
+import shlex
+from typing import Any
+
 from pasch.orchestrator import Module, Orchestrator
 from pasch.util import run_execute
 
@@ -10,5 +13,19 @@ class Echo(Module):
     def add(self, arg: str) -> None:
         self.args.append(arg)
 
-    def execute(self) -> None:
-        run_execute("echo", *self.args)
+    def inputs(self) -> Any:
+        return self.args
+
+    def observe(self) -> Any:
+        # Echoing has no effect on the system that could be observed, so the
+        # module is executed on every run
+        return None
+
+    def plan(self) -> Any:
+        return {"args": self.args}
+
+    def changes(self, plan: Any) -> list[str]:
+        return [f"echo {shlex.join(plan['args'])}"] if plan["args"] else []
+
+    def apply(self, plan: Any) -> None:
+        run_execute("echo", *plan["args"], interactive=False)
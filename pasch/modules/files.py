@@ -1,29 +1,226 @@
+from __future__ import annotations
+
+import errno
 import hashlib
 import json
+import os
 import random
+import re
+import shutil
 import string
+from collections.abc import Iterable, Iterator
+from contextlib import contextmanager
+from dataclasses import dataclass
 from pathlib import Path
+from typing import TYPE_CHECKING, Any, BinaryIO
 
 from rich.console import Console
 from rich.markup import escape
 
-from pasch.file.file import File
+from pasch.file.file import File, fingerprint
 from pasch.orchestrator import Module, Orchestrator
+from pasch.profile import count
 from pasch.util import fmt_diff, prompt
 
+if TYPE_CHECKING:
+    from pasch.store import Generation
+
+TMP_SUFFIX = "~pasch"
+TMP_NAME_RE = re.compile(r"\..+\.[A-Za-z0-9]{6}" + re.escape(TMP_SUFFIX))
+
 
 def random_tmp_path(path: Path) -> Path:
     prefix = "" if path.name.startswith(".") else "."
-    suffix = random.sample(string.ascii_letters + string.digits, 6)
-    name = f"{prefix}{path.name}.{suffix}~pasch"
+    suffix = "".join(random.choices(string.ascii_letters + string.digits, k=6))
+    name = f"{prefix}{path.name}.{suffix}{TMP_SUFFIX}"
     return path.with_name(name)
 
 
-def atomic_write(path: Path, content: bytes) -> None:
+def remove_tmp_files(dir: Path) -> None:
+    """
+    Remove temporary files left behind in a directory by an interrupted run.
+    """
+    try:
+        names = os.listdir(dir)
+    except (FileNotFoundError, NotADirectoryError):
+        return
+
+    for name in names:
+        if TMP_NAME_RE.fullmatch(name):
+            (dir / name).unlink(missing_ok=True)
+
+
+class DirSync:
+    """
+    Makes writes durable while only fsyncing each modified directory once.
+
+    The contents of every file are fsynced before it is renamed into place.
+    The directories containing the renamed files are collected and only
+    fsynced when `sync()` is called.
+    """
+
+    def __init__(self) -> None:
+        self._dirs: set[Path] = set()
+
+    def add(self, dir: Path) -> None:
+        self._dirs.add(dir)
+
+    def mkdir(self, dir: Path) -> None:
+        """
+        Create a directory and its missing parents. The directories the new
+        directories are created in are fsynced as well.
+        """
+        missing = []
+        while not dir.is_dir():
+            missing.append(dir)
+            dir = dir.parent
+        for dir in reversed(missing):
+            dir.mkdir(exist_ok=True)
+            self._dirs.add(dir.parent)
+
+    def sync(self) -> None:
+        for dir in sorted(self._dirs):
+            try:
+                fd = os.open(dir, os.O_RDONLY | os.O_DIRECTORY)
+            except FileNotFoundError:
+                continue  # Removed again, its parent is synced instead
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+        self._dirs.clear()
+
+
+_use_o_tmpfile = hasattr(os, "O_TMPFILE") and os.path.isdir("/proc/self/fd")
+
+
+def _open_named_tmp(path: Path) -> tuple[int, Path]:
     tmp_path = random_tmp_path(path)
-    path.parent.mkdir(parents=True, exist_ok=True)
-    tmp_path.write_bytes(content)
-    tmp_path.rename(path)
+    flags = os.O_WRONLY | os.O_CREAT | os.O_EXCL
+    return os.open(tmp_path, flags, 0o666), tmp_path
+
+
+def _open_tmp(path: Path) -> tuple[int, Path | None]:
+    # Anonymous temporary files disappear on their own if we crash before they
+    # are linked into the file system, so they never leave garbage behind.
+    if _use_o_tmpfile:
+        try:
+            return os.open(path.parent, os.O_TMPFILE | os.O_RDWR, 0o666), None
+        except OSError as e:
+            # O_TMPFILE is not supported by all file systems
+            if e.errno not in {errno.EOPNOTSUPP, errno.EISDIR, errno.EINVAL}:
+                raise
+
+    return _open_named_tmp(path)
+
+
+def _link_tmp(fd: int, path: Path) -> tuple[int, Path]:
+    # linkat() can't replace existing files, so we still need to give the file
+    # a temporary name before renaming it.
+    tmp_path = random_tmp_path(path)
+    try:
+        # The /proc link can only be followed by linkat() with
+        # AT_SYMLINK_FOLLOW. os.link() only calls linkat() if a dir fd is
+        # given, which is ignored for absolute paths.
+        os.link(f"/proc/self/fd/{fd}", tmp_path, src_dir_fd=fd, follow_symlinks=True)
+        return fd, tmp_path
+    except OSError:
+        pass
+
+    # Some environments refuse to link anonymous files even though they can be
+    # created. Copy the contents to a named file instead and stop trying.
+    global _use_o_tmpfile
+    _use_o_tmpfile = False
+
+    named_fd, tmp_path = _open_named_tmp(path)
+    try:
+        os.lseek(fd, 0, os.SEEK_SET)
+        copy_fd(fd, named_fd)
+    except BaseException:
+        os.close(named_fd)
+        tmp_path.unlink(missing_ok=True)
+        raise
+    os.close(fd)
+    return named_fd, tmp_path
+
+
+@contextmanager
+def atomic_open(path: Path, sync: DirSync | None = None) -> Iterator[BinaryIO]:
+    if sync is not None:
+        sync.mkdir(path.parent)
+    else:
+        path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp_path = _open_tmp(path)
+    try:
+        with open(fd, "wb", closefd=False) as f:
+            yield f
+
+        if tmp_path is None:
+            fd, tmp_path = _link_tmp(fd, path)
+
+        if sync is not None:
+            os.fsync(fd)
+
+        tmp_path.rename(path)
+    except BaseException:
+        if tmp_path is not None:
+            tmp_path.unlink(missing_ok=True)
+        raise
+    finally:
+        os.close(fd)
+
+    if sync is not None:
+        sync.add(path.parent)
+
+
+def atomic_write(
+    path: Path,
+    content: bytes | Iterable[bytes],
+    sync: DirSync | None = None,
+) -> None:
+    with atomic_open(path, sync) as f:
+        if isinstance(content, bytes):
+            f.write(content)
+        else:
+            for chunk in content:
+                f.write(chunk)
+
+
+_UNSUPPORTED_ERRNOS = {errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP}
+
+
+def copy_fd(src: int, dst: int) -> None:
+    # Let the kernel copy the data (or even share extents via reflinks)
+    # without it ever passing through userspace. os.copy_file_range is only
+    # available if python was built against a recent enough libc.
+    if hasattr(os, "copy_file_range"):
+        try:
+            while os.copy_file_range(src, dst, 1024 * 1024 * 1024):
+                pass
+            return
+        except OSError as e:
+            if e.errno not in _UNSUPPORTED_ERRNOS:
+                raise
+
+    # copy_file_range may not work across file systems, so fall back to
+    # sendfile, which still avoids copying into userspace. All calls advance
+    # the file offsets, so we can continue where the previous one stopped.
+    if hasattr(os, "sendfile"):
+        try:
+            while os.sendfile(dst, src, None, 1024 * 1024 * 1024):
+                pass
+            return
+        except OSError as e:
+            if e.errno not in _UNSUPPORTED_ERRNOS:
+                raise
+
+    with open(src, "rb", closefd=False) as s, open(dst, "wb", closefd=False) as d:
+        shutil.copyfileobj(s, d)
+
+
+def atomic_copy(path: Path, source: Path, sync: DirSync | None = None) -> None:
+    with open(source, "rb") as src, atomic_open(path, sync) as dst:
+        copy_fd(src.fileno(), dst.fileno())
 
 
 def set_executable(path: Path, executable: bool) -> None:
@@ -45,10 +242,23 @@ def hash_data(data: bytes) -> str:
 
 def hash_file(path: Path) -> str | None:
     try:
-        data = path.read_bytes()
+        with open(path, "rb") as f:
+            digest = hashlib.file_digest(f, "sha256")
+            count("files.hashed_bytes", f.tell())
+    except FileNotFoundError:
+        return None
+    return f"sha256-{digest.hexdigest()}"
+
+
+type FileStat = tuple[int, int, int]
+
+
+def stat_file(path: Path) -> FileStat | None:
+    try:
+        stat = path.stat()
     except FileNotFoundError:
         return None
-    return hash_data(data)
+    return (stat.st_mtime_ns, stat.st_size, stat.st_ino)
 
 
 def path_to_str(path: Path) -> str:
@@ -70,11 +280,70 @@ def diff_and_prompt(c: Console, path: Path, new_content_bytes: bytes) -> bool:
     return prompt("Replace file contents?", default=False)
 
 
+@dataclass
+class FileDbEntry:
+    hash: str
+    # The stat of the file right after we last wrote or verified it. If the
+    # file still has this stat, we assume it still has this hash.
+    stat: FileStat | None = None
+    # The fingerprint of the config the file was last written or verified for.
+    # If neither it nor the stat changed, the file is still in its target state.
+    config: str | None = None
+
+    @classmethod
+    def from_json(cls, key: str, data: object) -> "FileDbEntry":
+        # Older dbs only stored the hash
+        if type(data) is str:
+            return cls(data)
+
+        if type(data) is not dict or type(data.get("hash")) is not str:
+            raise ValueError(f"file db contains invalid entry at key {key!r}")
+
+        stat = data.get("stat")
+        if stat is not None:
+            if type(stat) is not list or len(stat) != 3:
+                raise ValueError(f"file db contains invalid stat at key {key!r}")
+            stat = (int(stat[0]), int(stat[1]), int(stat[2]))
+
+        config = data.get("config")
+        if config is not None and type(config) is not str:
+            raise ValueError(f"file db contains invalid config at key {key!r}")
+
+        return cls(data["hash"], stat, config)
+
+    def to_json(self) -> object:
+        if self.stat is None:
+            return self.hash
+        data: dict[str, object] = {"hash": self.hash, "stat": list(self.stat)}
+        if self.config is not None:
+            data["config"] = self.config
+        return data
+
+
 class FileDb:
-    def __init__(self, path: Path) -> None:
-        self._path = path
+    """
+    Remembers the hashes of all files written by pasch.
+
+    The db is loaded once and then kept in memory. Changes are appended to a
+    journal next to the db file as soon as they are made, so they survive a
+    crash, and are only folded into the db file itself on `commit()`.
+    """
 
-    def _load(self) -> dict[str, str]:
+    def __init__(
+        self,
+        path: Path,
+        checkpoint_every: int | None = None,
+        sync: DirSync | None = None,
+    ) -> None:
+        self._path = path
+        self._journal_path = path.with_name(f"{path.name}.journal")
+        self._checkpoint_every = checkpoint_every
+        self._sync = sync
+        self._data: dict[str, FileDbEntry] | None = None
+        self._journaled: int = 0
+
+    def _load_db(self) -> dict[str, FileDbEntry]:
+        count("filedb.loads")
         try:
             text = self._path.read_text(encoding="utf-8")
         except FileNotFoundError:
@@ -83,29 +352,107 @@ class FileDb:
         data = json.loads(text)
         if type(data) is not dict:
             raise ValueError("file db is not a dict")
-        for k, v in data.items():
-            if type(v) is not str:
-                raise ValueError(f"file db contains non-str hash at key {k!r}")
-        return data
+        return {k: FileDbEntry.from_json(k, v) for k, v in data.items()}
 
-    def _save(self, data: dict[str, str]) -> None:
-        atomic_write(self._path, json.dumps(data, indent=2).encode("utf-8"))
+    def _replay_journal(self, data: dict[str, FileDbEntry]) -> int:
+        try:
+            text = self._journal_path.read_text(encoding="utf-8")
+        except FileNotFoundError:
+            return 0
 
-    def add_hash(self, path: Path, hash: str) -> None:
+        entries = 0
+        for line in text.splitlines():
+            try:
+                path, entry = json.loads(line)
+            except ValueError:
+                break  # Torn write at the end of the journal
+            if entry is None:
+                data.pop(path, None)
+            else:
+                data[path] = FileDbEntry.from_json(path, entry)
+            entries += 1
+        return entries
+
+    def _load(self) -> dict[str, FileDbEntry]:
+        if self._data is None:
+            data = self._load_db()
+            self._journaled = self._replay_journal(data)
+            self._data = data
+        return self._data
+
+    def _journal(self, path: str, entry: FileDbEntry | None) -> None:
+        entry_json = None if entry is None else entry.to_json()
+        line = json.dumps([path, entry_json]) + "\n"
+        self._journal_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self._journal_path, "a", encoding="utf-8") as f:
+            f.write(line)
+        self._journaled += 1
+
+        if self._checkpoint_every and self._journaled >= self._checkpoint_every:
+            self.commit()
+
+    def commit(self) -> None:
+        if self._data is None or not self._journaled:
+            return
+
+        count("filedb.saves")
+        data = {k: v.to_json() for k, v in self._data.items()}
+        atomic_write(self._path, json.dumps(data, indent=2).encode("utf-8"), self._sync)
+        if self._sync is not None:
+            self._sync.sync()
+        self._journal_path.unlink(missing_ok=True)
+        self._journaled = 0
+
+    def get_entry(self, path: Path) -> FileDbEntry | None:
+        return self.lookup(path_to_str(path))
+
+    def lookup(self, key: str) -> FileDbEntry | None:
+        """
+        Like `get_entry()`, for a path already normalized by `path_to_str()`.
+        """
+        return self._load().get(key)
+
+    def get_hash(self, path: Path) -> str | None:
+        entry = self.get_entry(path)
+        return None if entry is None else entry.hash
+
+    def add_hash(
+        self,
+        path: Path,
+        hash: str,
+        stat: FileStat | None = None,
+        config: str | None = None,
+    ) -> None:
         data = self._load()
-        data[path_to_str(path)] = hash
-        self._save(data)
+        key = path_to_str(path)
+        entry = FileDbEntry(hash, stat, config)
+        if data.get(key) == entry:
+            return
+        data[key] = entry
+        self._journal(key, entry)
 
     def remove_hash(self, path: Path) -> None:
         data = self._load()
-        data.pop(path_to_str(path), None)
-        self._save(data)
+        key = path_to_str(path)
+        if key not in data:
+            return
+        del data[key]
+        self._journal(key, None)
+
+    def known_hash(self, path: Path, stat: FileStat | None) -> str | None:
+        """
+        Return the recorded hash of a file if its stat hasn't changed since the
+        hash was recorded, meaning the file doesn't need to be hashed again.
+        """
+        entry = self.get_entry(path)
+        if entry is None or entry.stat is None or entry.stat != stat:
+            return None
+        return entry.hash
 
     def verify_hash(self, path: Path, cur_hash: str | None) -> str | None:
-        cur_hash = hash_file(path)
         if cur_hash is None:
             return
-        known_hash = self._load().get(path_to_str(path))
+        known_hash = self.get_hash(path)
         if known_hash is None:
             return "File unknown and contents don't match target state."
         if known_hash != cur_hash:
@@ -114,6 +461,64 @@ class FileDb:
     def paths(self) -> list[str]:
         return list(sorted(self._load().keys()))
 
+    def hashes(self) -> dict[str, str]:
+        return {k: v.hash for k, v in sorted(self._load().items())}
+
+
+@dataclass
+class _Rendered:
+    target_hash: str
+    cur_hash: str | None
+    cur_stat: FileStat | None
+
+
+class RenderCache:
+    """
+    Remembers the hashes of rendered files by their fingerprint across runs, so
+    unchanged files need neither be rendered nor hashed.
+
+    Only entries used or kept during the current run are saved again, so the
+    cache doesn't grow beyond the files that are currently managed.
+    """
+
+    def __init__(self, path: Path) -> None:
+        self._path = path
+        self._old: dict[str, str] | None = None
+        self._new: dict[str, str] = {}
+
+    def load(self) -> dict[str, str]:
+        if self._old is not None:
+            return self._old
+
+        try:
+            data = json.loads(self._path.read_text(encoding="utf-8"))
+        except (FileNotFoundError, ValueError):
+            data = {}
+        if type(data) is not dict:
+            data = {}
+
+        self._old = {k: v for k, v in data.items() if type(v) is str}
+        return self._old
+
+    def get(self, fingerprint: str) -> str | None:
+        return self.load().get(fingerprint)
+
+    def put(self, fingerprint: str, hash: str) -> None:
+        self._new[fingerprint] = hash
+
+    def keep(self, fingerprint: str) -> None:
+        """
+        Keep the entry of a file that is still managed, but wasn't rendered.
+        """
+        if (hash := self.get(fingerprint)) is not None:
+            self._new.setdefault(fingerprint, hash)
+
+    def save(self) -> None:
+        if self._new == self.load():
+            return
+        data = json.dumps(self._new, indent=2, sort_keys=True)
+        atomic_write(self._path, data.encode("utf-8"))
+
 
 class Files(Module):
     def __init__(
@@ -121,11 +526,50 @@ class Files(Module):
         orchestrator: Orchestrator,
         file_db_name: str = "files.json",
         root: Path | None = None,
+        checkpoint_every: int | None = None,
+        render_cache_name: str = "render-cache.json",
+        paranoid: bool = False,
+        jobs: int = 1,
+        durable: bool = False,
+        history: int = 10,
+        compress_history: bool = False,
     ) -> None:
+        # The store builds on the file writing functions of this module
+        from pasch.store import GenerationLog, ObjectStore
+
         super().__init__(orchestrator)
         self._files: dict[str, File] = {}
-        self._file_db = FileDb(self.o.state_dir / file_db_name)
-        self._root = root or Path.home()
+        # Fsync all written files, and each directory containing them once
+        self._sync = DirSync() if durable else None
+        self._file_db = FileDb(
+            self.o.state_dir / file_db_name, checkpoint_every, self._sync
+        )
+        self._render_cache = RenderCache(self.o.state_dir / render_cache_name)
+        self._root = root or self.o.home()
+
+        # Always render and hash files instead of trusting the stat recorded in
+        # the file db and the hashes in the render cache
+        self.paranoid = paranoid
+
+        # Render and hash up to this many files concurrently. Prompts, writes
+        # and file db updates still happen one file at a time in path order.
+        self.jobs = jobs
+
+        # Keep the contents of the managed files for this many generations, so
+        # they can be rolled back. A generation is recorded for every run that
+        # changes files.
+        self.history = history
+        stem = Path(file_db_name).stem
+        self._objects = ObjectStore(
+            self.o.state_dir / "objects" / stem, compress_history
+        )
+        self._generations = GenerationLog(
+            self.o.state_dir / f"{stem}.generations.jsonl"
+        )
+        # The contents of files replaced or removed during the current run
+        self._previous: dict[str, str | None] = {}
+
+        self._converged = True
 
     def _read_path(self, path: Path | str) -> Path:
         return self._root / path
@@ -134,51 +578,329 @@ class Files(Module):
         path = self._read_path(path)
         self._files[path_to_str(path)] = file
 
-    def execute(self) -> None:
-        for path, file in sorted(self._files.items()):
-            self._write_file(self._read_path(path), file)
-
-        for path in self._file_db.paths():
-            if path not in self._files:
-                self._remove_file(self._read_path(path))
-
-    def _write_file(self, path: Path, file: File) -> None:
-        content = file.to_bytes()
-
-        cur_hash = hash_file(path)
-        target_hash = hash_data(content)
-        if cur_hash == target_hash:
-            self._file_db.add_hash(path, target_hash)
+    def inputs(self) -> Any:
+        return {
+            path: [file.fingerprint() or file.digest(), file.executable]
+            for path, file in sorted(self._files.items())
+        }
+
+    def observe(self) -> Any:
+        # Paranoid runs must never be skipped based on stats alone
+        if self.paranoid:
+            return None
+        paths = self._files.keys() | set(self._file_db.paths())
+        return {path: stat_file(Path(path)) for path in sorted(paths)}
+
+    def converged(self) -> bool:
+        return self._converged
+
+    def plan(self) -> Any:
+        # Load the db and cache before any worker threads might access them
+        known_paths = self._file_db.paths()
+        self._render_cache.load()
+
+        files = []
+        for p, f in sorted(self._files.items()):
+            if self.paranoid or self.o.force or self._outdated(p, f):
+                files.append((self._read_path(p), f))
+            elif (fingerprint := f.fingerprint()) is not None:
+                # The file is still managed and will be rendered again
+                self._render_cache.keep(fingerprint)
+        unknown_paths = [path for path in known_paths if path not in self._files]
+
+        # Dry runs, like `pasch status`, must not change anything, not even the
+        # file db or the render cache
+        dry_run = self.o.dry_run
+
+        # Clean up after previous runs that were interrupted mid-write. Files
+        # interrupted while being written are always outdated.
+        if not dry_run:
+            dirs = {path.parent for path, _ in files}
+            dirs.update(self._read_path(path).parent for path in unknown_paths)
+            for dir in sorted(dirs):
+                remove_tmp_files(dir)
+
+        write = []
+        remove = []
+        try:
+            if self.jobs > 1:
+                from concurrent.futures import ThreadPoolExecutor
+
+                with ThreadPoolExecutor(max_workers=self.jobs) as executor:
+                    rendered = list(executor.map(lambda pf: self._render(*pf), files))
+            else:
+                rendered = [self._render(path, file) for path, file in files]
+
+            for (path, file), r in zip(files, rendered):
+                if r.cur_hash == r.target_hash:
+                    if not dry_run:
+                        config = self._config_fingerprint(file)
+                        self._file_db.add_hash(path, r.target_hash, r.cur_stat, config)
+                    continue
+                write.append(
+                    {
+                        "path": path_to_str(path),
+                        "cur_hash": r.cur_hash,
+                        "conflict": self._file_db.verify_hash(path, r.cur_hash),
+                    }
+                )
+
+            for path in unknown_paths:
+                cur_hash, _ = self._hash_file(self._read_path(path))
+                remove.append(
+                    {
+                        "path": path,
+                        "cur_hash": cur_hash,
+                        "conflict": self._file_db.verify_hash(Path(path), cur_hash),
+                    }
+                )
+        finally:
+            if not dry_run:
+                self._file_db.commit()
+                self._render_cache.save()
+
+        return {"write": write, "remove": remove}
+
+    def _display_path(self, path: Path | str) -> str:
+        return str(Path(path).relative_to(self._root, walk_up=True))
+
+    def changes(self, plan: Any) -> list[str]:
+        changes = []
+        for entry in plan["write"]:
+            op = "+" if entry["cur_hash"] is None else "~"
+            changes.append(f"{op} {self._display_path(entry['path'])}")
+        for entry in plan["remove"]:
+            changes.append(f"- {self._display_path(entry['path'])}")
+        return changes
+
+    def diff(self, plan: Any) -> None:
+        for change, entry in zip(self.changes(plan), plan["write"] + plan["remove"]):
+            self.c.print(escape(change))
+            path = Path(entry["path"])
+            file = self._files.get(entry["path"])
+            try:
+                old = "" if entry["cur_hash"] is None else path.read_text("utf-8")
+                new = "" if file is None else file.render().decode("utf-8")
+            except (OSError, UnicodeDecodeError):
+                self.c.print("[bright_black]Binary contents differ")
+                continue
+            name = self._display_path(path)
+            self.c.print(fmt_diff(old, new, f"a/{name}", f"b/{name}"))
+
+    def artifacts(self, plan: Any) -> dict[str, bytes]:
+        """
+        The contents of the files the plan would write, by hash. The hashes are
+        added to the plan, so `apply()` can copy the contents from
+        `Orchestrator.artifacts` instead of rendering the files again.
+        """
+        result = {}
+        for entry in plan["write"]:
+            file = self._files.get(entry["path"])
+            if file is not None:
+                entry["hash"] = file.digest()
+                result[entry["hash"]] = file.render()
+        return result
+
+    def apply(self, plan: Any) -> None:
+        self._converged = True
+        try:
+            for entry in plan["write"]:
+                self._write_file(entry)
+            for entry in plan["remove"]:
+                self._remove_file(entry)
+        finally:
+            self._finish()
+
+    def _finish(self) -> None:
+        # Written files must be durable before the db is, which commit()
+        # takes care of by syncing again after writing the db.
+        if self.o.dry_run:
+            return
+        if self._sync is not None:
+            self._sync.sync()
+        self._file_db.commit()
+        self._record_generation()
+
+    def _save_previous(self, path: Path, cur_hash: str | None) -> None:
+        # Keep what the run replaces, which may include changes by the user
+        key = path_to_str(path)
+        if self.history and key not in self._previous:
+            if cur_hash is not None:
+                cur_hash = self._objects.put_file(path, cur_hash)
+            self._previous[key] = cur_hash
+
+    def _record_generation(self) -> None:
+        if not self._previous:
             return
 
+        last = self._generations.last()
+        last_files = {} if last is None else last.files
+        last_executable = set() if last is None else set(last.executable)
+
+        files = self._file_db.hashes()
+        executable = []
+        for path_str, hash in files.items():
+            # Contents that haven't changed since the last generation are
+            # stored already, along with whether they're executable
+            if path_str not in self._previous and last_files.get(path_str) == hash:
+                if path_str in last_executable:
+                    executable.append(path_str)
+                continue
+
+            # Files are stored once they're in their target state, and usually
+            # are by now. Files changed by the user can't be rolled back to.
+            path = Path(path_str)
+            cur_hash, _ = self._hash_file(path)
+            if cur_hash == hash:
+                self._objects.put_file(path, hash)
+                if path.stat().st_mode & 0o100:
+                    executable.append(path_str)
+
+        self._generations.append(files, executable, self._previous)
+        self._previous = {}
+
+        self._objects.remove(self._generations.prune(self.history))
+
+    def generations(self) -> list[Generation]:
+        return self._generations.load()
+
+    def rollback(self, generation: int) -> None:
+        """
+        Restore the managed files to their state after the given generation,
+        using the contents kept in the history instead of rendering the config.
+        The rollback itself is recorded as a new generation.
+        """
+        gen = self._generations.get(generation)
+        self._converged = True
+        try:
+            for path, hash in sorted(gen.files.items()):
+                self._restore_file(Path(path), hash, path in gen.executable)
+            for path in self._file_db.paths():
+                if path not in gen.files:
+                    cur_hash, _ = self._hash_file(Path(path))
+                    conflict = self._file_db.verify_hash(Path(path), cur_hash)
+                    self._remove_file(
+                        {"path": path, "cur_hash": cur_hash, "conflict": conflict}
+                    )
+        finally:
+            self._finish()
+
+    def _config_fingerprint(self, file: File) -> str:
+        return fingerprint(file.fingerprint() or file.digest(), file.executable)
+
+    def _outdated(self, path: str, file: File) -> bool:
+        # Files whose config and stat didn't change since they were last written
+        # or verified don't need to be looked at again
+        entry = self._file_db.lookup(path)
+        return (
+            entry is None
+            or entry.stat is None
+            or entry.stat != stat_file(Path(path))
+            or entry.config != self._config_fingerprint(file)
+        )
+
+    def _hash_file(self, path: Path) -> tuple[str | None, FileStat | None]:
+        stat = stat_file(path)
+        if stat is None:
+            return None, None
+        if not self.paranoid:
+            if known_hash := self._file_db.known_hash(path, stat):
+                return known_hash, stat
+        return hash_file(path), stat
+
+    def _target_hash(self, file: File) -> str:
+        fingerprint = None if self.paranoid else file.fingerprint()
+        if fingerprint is None:
+            return file.digest()
+
+        target_hash = self._render_cache.get(fingerprint) or file.digest()
+        self._render_cache.put(fingerprint, target_hash)
+        return target_hash
+
+    def _render(self, path: Path, file: File) -> _Rendered:
+        target_hash = self._target_hash(file)
+        cur_hash, cur_stat = self._hash_file(path)
+        return _Rendered(target_hash, cur_hash, cur_stat)
+
+    def _conflict(self, path: Path, entry: dict[str, Any]) -> str | None:
+        # Files may have been modified since the plan was computed
+        if self._hash_file(path)[0] != entry["cur_hash"]:
+            return "File contents changed since the plan was computed."
+        return entry["conflict"]
+
+    def _write_file(self, entry: dict[str, Any]) -> None:
+        path = Path(entry["path"])
         relative_path = path.relative_to(self._root, walk_up=True)
-        if cur_hash is None:
+        if entry["cur_hash"] is None:
             self.c.print(f"[bold green]+[/] {escape(str(relative_path))}")
         else:
             self.c.print(f"[bold yellow]~[/] {escape(str(relative_path))}")
 
-        if reason := self._file_db.verify_hash(path, cur_hash):
+        file = self._files.get(entry["path"])
+        if file is None:
+            self.c.print("[red]Error:[/] File is not part of the config.")
+            self._converged = False
+            return
+
+        if reason := self._conflict(path, entry):
             self.c.print(f"[red]Error:[/] {escape(reason)}")
-            if not diff_and_prompt(self.c, path, content):
+            if (
+                self.o.dry_run
+                or not self.o.interactive
+                or not diff_and_prompt(self.c, path, file.render())
+            ):
+                self._converged = False
                 return
 
+        if self.o.dry_run:
+            return
+
+        self._save_previous(path, entry["cur_hash"])
+
+        # Contents rendered while planning can be copied from the artifacts,
+        # which are stored by their actual hash.
+        artifacts = self.o.artifacts
+        if artifacts is not None and not (
+            "hash" in entry and artifacts.has(entry["hash"])
+        ):
+            artifacts = None
+
+        # The hash from the render cache could be wrong if a file's fingerprint
+        # doesn't capture all of its data, so we use the actual hash from now on.
+        target_hash = file.digest() if artifacts is None else entry["hash"]
+
         # We want to avoid scenarios where we fail to remember a file we've
         # written. It is better to remember a file with an incorrect hash than
         # to forget it entirely. Thus, we must always update the file db before
         # we write a file.
         self._file_db.add_hash(path, target_hash)
-        atomic_write(path, content)
+        if artifacts is not None:
+            artifacts.restore(target_hash, path, self._sync)
+        elif (source := file.source()) is not None:
+            atomic_copy(path, source, self._sync)
+        else:
+            atomic_write(path, file.chunks(), self._sync)
         set_executable(path, file.executable)
-
-    def _remove_file(self, path: Path) -> None:
+        stat = stat_file(path)
+        config = self._config_fingerprint(file)
+        self._file_db.add_hash(path, target_hash, stat, config)
+        if stat is not None:
+            count("files.written_bytes", stat[1])
+
+    def _remove_file(self, entry: dict[str, Any]) -> None:
+        path = Path(entry["path"])
         relative_path = path.relative_to(self._root, walk_up=True)
         self.c.print(f"[bold red]-[/] {escape(str(relative_path))}")
 
-        cur_hash = hash_file(path)
-        if reason := self._file_db.verify_hash(path, cur_hash):
+        if reason := self._conflict(path, entry):
             self.c.print(f"[red]Error:[/] {escape(reason)}")
+            self._converged = False
             return
 
+        if self.o.dry_run:
+            return
+
+        self._save_previous(path, entry["cur_hash"])
         try:
             path.unlink()
         except FileNotFoundError:
@@ -187,8 +909,50 @@ class Files(Module):
             try:
                 parent.rmdir()
             except:
+                # The removal is durable once the remaining directory is synced
+                if self._sync is not None:
+                    self._sync.add(parent)
                 break
 
         # We want to avoid scenarios where we forget a file without actually
         # removing it. Thus, the db must be updated after the removal.
         self._file_db.remove_hash(path)
+
+    def _restore_file(self, path: Path, hash: str, executable: bool) -> None:
+        cur_hash, cur_stat = self._hash_file(path)
+        if cur_hash == hash:
+            if not self.o.dry_run:
+                self._file_db.add_hash(path, hash, cur_stat)
+                set_executable(path, executable)
+            return
+
+        relative_path = path.relative_to(self._root, walk_up=True)
+        if cur_hash is None:
+            self.c.print(f"[bold green]+[/] {escape(str(relative_path))}")
+        else:
+            self.c.print(f"[bold yellow]~[/] {escape(str(relative_path))}")
+
+        if not self._objects.has(hash):
+            self.c.print("[red]Error:[/] Contents are not in the history.")
+            self._converged = False
+            return
+
+        if reason := self._file_db.verify_hash(path, cur_hash):
+            self.c.print(f"[red]Error:[/] {escape(reason)}")
+            if (
+                self.o.dry_run
+                or not self.o.interactive
+                or not diff_and_prompt(self.c, path, self._objects.read(hash))
+            ):
+                self._converged = False
+                return
+
+        if self.o.dry_run:
+            return
+
+        self._save_previous(path, cur_hash)
+        # Same as for writes, the db must be updated first
+        self._file_db.add_hash(path, hash)
+        self._objects.restore(hash, path, self._sync)
+        set_executable(path, executable)
+        self._file_db.add_hash(path, hash, stat_file(path))
@@ -1,6 +1,8 @@
 import os
 from dataclasses import dataclass
+from typing import Any
 
+from pasch.escape import escaper
 from pasch.file.text import TextFile
 from pasch.modules.files import Files
 from pasch.modules.pacman import Pacman
@@ -8,12 +10,13 @@ from pasch.orchestrator import Module, Orchestrator
 from pasch.util import prompt, run_execute
 
 
+# The only meaningful escape sequences in single quotes are `\'`, which escapes
+# a single quote and `\\`, which escapes the backslash symbol.
+_escape_single_quoted = escaper({"\\": "\\\\", "'": "\\'"})
+
+
 def escape(s: str) -> str:
-    # The only meaningful escape sequences in single quotes are `\'`, which
-    # escapes a single quote and `\\`, which escapes the backslash symbol.
-    ESCAPES = {"'": "\\'", "\\": "\\\\"}
-    escaped = "".join(ESCAPES.get(c, c) for c in s)
-    return f"'{escaped}'"
+    return f"'{_escape_single_quoted(s)}'"
 
 
 @dataclass
@@ -48,6 +51,8 @@ class Fish(Module):
         self.commands: list[str] = []
         self.interactive_commands: list[str] = []
 
+        self._converged = True
+
     def add_to_path(self, value: FishStr) -> None:
         self.path.append(value)
 
@@ -97,11 +102,41 @@ class Fish(Module):
         self._files.add(".config/fish/config.fish", file)
         self._pacman.install("fish")
 
-    def execute(self) -> None:
-        shell = os.environ.get("SHELL")
-        if shell == "/usr/bin/fish":
+    def _login_shell(self) -> str | None:
+        # Read the user's entry in the host's passwd file, so this also works
+        # for other hosts and right after the shell was changed
+        entry = self.o.passwd()
+        if entry is None:
+            return os.environ.get("SHELL")
+        return entry[6]
+
+    def inputs(self) -> Any:
+        return {}
+
+    def observe(self) -> Any:
+        return {"shell": self._login_shell()}
+
+    def converged(self) -> bool:
+        return self._converged
+
+    def plan(self) -> Any:
+        return {"set_shell": self._login_shell() != "/usr/bin/fish"}
+
+    def changes(self, plan: Any) -> list[str]:
+        return ["Set the login shell to fish"] if plan["set_shell"] else []
+
+    def apply(self, plan: Any) -> None:
+        self._converged = True
+        if not plan["set_shell"]:
+            return
+        if self.o.dry_run or not self.o.interactive:
+            self.c.print("Your shell is not fish.")
+            if not self.o.dry_run:
+                self._converged = False
             return
         fix = prompt("Your shell is not fish. Set it to fish?", default=False)
         if not fix:
+            self._converged = False
             return
-        run_execute("sudo", "usermod", "--shell", "/usr/bin/fish", self.o.user)
+        cmd = ("usermod", "--shell", "/usr/bin/fish", self.o.user)
+        run_execute("sudo", *self.o.transport.command(cmd))
@@ -1,8 +1,12 @@
+import shlex
 from dataclasses import dataclass, field
+from pathlib import Path
 from subprocess import CalledProcessError
+from typing import Any
 
 from rich.markup import escape
 
+from pasch.modules.pacman_db import LocalPackage, PacmanDb, required_packages
 from pasch.orchestrator import Module, Orchestrator
 from pasch.util import run_capture, run_execute
 
@@ -13,6 +17,180 @@ class PacmanPackage:
     exclude: set[str] = field(default_factory=set)
 
 
+@dataclass
+class PacmanPlan:
+    """
+    All changes to the installed packages, grouped into as few pacman
+    transactions as possible.
+    """
+
+    install: set[str] = field(default_factory=set)
+    mark_explicit: set[str] = field(default_factory=set)
+    mark_deps: set[str] = field(default_factory=set)
+    remove: set[str] = field(default_factory=set)
+
+    @classmethod
+    def compute(
+        cls,
+        local: dict[str, LocalPackage],
+        target: set[str],
+    ) -> "PacmanPlan":
+        explicit = {name for name, package in local.items() if package.explicit}
+        to_install = target - explicit
+        to_uninstall = explicit - target
+
+        # Packages we no longer want may still be required by others, in which
+        # case they must be kept as dependencies instead of being removed.
+        required = required_packages(local, target)
+
+        return cls(
+            install=to_install - local.keys(),
+            mark_explicit=to_install & local.keys(),
+            mark_deps=to_uninstall & required,
+            remove=local.keys() - required,
+        )
+
+    def to_json(self) -> dict[str, list[str]]:
+        return {
+            "install": sorted(self.install),
+            "mark_explicit": sorted(self.mark_explicit),
+            "mark_deps": sorted(self.mark_deps),
+            "remove": sorted(self.remove),
+        }
+
+    @classmethod
+    def from_json(cls, data: dict[str, list[str]]) -> "PacmanPlan":
+        return cls(
+            install=set(data["install"]),
+            mark_explicit=set(data["mark_explicit"]),
+            mark_deps=set(data["mark_deps"]),
+            remove=set(data["remove"]),
+        )
+
+    def changes_before_removal(self) -> list[tuple[str, ...]]:
+        transactions: list[tuple[str, ...]] = []
+        if self.install:
+            transactions.append(
+                ("-S", "--needed", "--asexplicit", *sorted(self.install))
+            )
+        if self.mark_explicit:
+            transactions.append(("-D", "--asexplicit", *sorted(self.mark_explicit)))
+        if self.mark_deps:
+            transactions.append(("-D", "--asdeps", *sorted(self.mark_deps)))
+        return transactions
+
+    def removal(self) -> tuple[str, ...] | None:
+        if self.remove:
+            return ("-Rsn", *sorted(self.remove))
+        return None
+
+
+class PackageResolver:
+    """
+    Resolves declared packages and groups to the set of packages to install.
+
+    Groups that contain each other, directly or through other groups, form a
+    cycle and all resolve to the same packages. Every such strongly connected
+    component is resolved once (using Tarjan's algorithm), so resolution is
+    linear in the size of the group graph. The resolver also remembers which
+    declared package or group each package was pulled in by.
+    """
+
+    def __init__(
+        self,
+        groups: dict[str, set[str]],
+        excluded: dict[str, set[str]],
+    ) -> None:
+        self._groups = groups
+        self._excluded = excluded
+        self._resolved: dict[str, frozenset[str]] = {}
+
+        # State of Tarjan's algorithm for the groups that aren't resolved yet
+        self._index: dict[str, int] = {}
+        self._lowlink: dict[str, int] = {}
+        self._stack: list[str] = []
+        # The packages of each group on the stack, without those of the groups
+        # in the same component
+        self._packages: dict[str, set[str]] = {}
+
+        self.packages: set[str] = set()
+        self.declared: set[str] = set()
+        self.parents: dict[str, set[str]] = {}
+        # The groups of every cycle, sorted
+        self.cycles: list[tuple[str, ...]] = []
+
+    def resolve(self, names: set[str]) -> set[str]:
+        for name in sorted(names):
+            self.declared.add(name)
+            self.packages.update(self._resolve(name))
+        return self.packages
+
+    def _resolve(self, name: str) -> frozenset[str]:
+        if name not in self._groups:
+            return frozenset({name})
+        if name not in self._resolved:
+            self._visit(name)
+        return self._resolved[name]
+
+    def _visit(self, name: str) -> None:
+        index = len(self._index)
+        self._index[name] = index
+        self._lowlink[name] = index
+        self._stack.append(name)
+
+        packages = set()
+        for member in sorted(self._groups[name] - self._excluded.get(name, set())):
+            self.parents.setdefault(member, set()).add(name)
+            # A group containing a package of the same name refers to that
+            # package
+            if member == name or member not in self._groups:
+                packages.add(member)
+            elif (resolved := self._resolved.get(member)) is not None:
+                packages.update(resolved)
+            elif member not in self._index:
+                self._visit(member)
+                self._lowlink[name] = min(self._lowlink[name], self._lowlink[member])
+                if (resolved := self._resolved.get(member)) is not None:
+                    packages.update(resolved)
+            else:
+                # The member is still on the stack, so it is part of a cycle
+                self._lowlink[name] = min(self._lowlink[name], self._index[member])
+        self._packages[name] = packages
+
+        if self._lowlink[name] != index:
+            return
+
+        # All groups above this one on the stack are in its component
+        component = []
+        while (group := self._stack.pop()) != name:
+            component.append(group)
+        component.append(name)
+        resolved = frozenset().union(*(self._packages.pop(g) for g in component))
+        for group in component:
+            self._resolved[group] = resolved
+        if len(component) > 1:
+            self.cycles.append(tuple(sorted(component)))
+
+    def why(self, name: str) -> list[str] | None:
+        """
+        The shortest chain of groups from a declared name to the given package,
+        or `None` if the package is not wanted.
+        """
+        chains = [[name]]
+        seen = {name}
+        while chains:
+            next_chains = []
+            for chain in chains:
+                if chain[0] in self.declared:
+                    return chain
+                for parent in sorted(self.parents.get(chain[0], set())):
+                    if parent not in seen:
+                        seen.add(parent)
+                        next_chains.append([parent, *chain])
+            chains = next_chains
+        return None
+
+
 class Pacman(Module):
     def __init__(self, orchestrator: Orchestrator) -> None:
         super().__init__(orchestrator)
@@ -21,65 +199,131 @@ class Pacman(Module):
         self.packages: set[str] = set()
         self.excluded: dict[str, set[str]] = {}
 
+        # Read the package databases below this root directly instead of
+        # querying pacman. Falls back to pacman if they can't be read.
+        self.read_db: bool = True
+        self.root: Path = self.o.transport.path(Path("/"))
+
     def install(self, *packages: str) -> None:
         self.packages.update(packages)
 
     def exclude(self, group: str, *packages: str) -> None:
         self.excluded.setdefault(group, set()).update(packages)
 
-    def execute(self) -> None:
-        groups = self._get_groups()
+    def resolve(self) -> PackageResolver:
+        resolver = PackageResolver(self._get_groups(), self.excluded)
+        resolver.resolve(self.packages)
+        for cycle in resolver.cycles:
+            cycle_str = ", ".join(cycle)
+            self.c.print(f"[yellow]Warning:[/] Group cycle between {escape(cycle_str)}")
+        return resolver
+
+    def inputs(self) -> Any:
+        return {
+            "packages": sorted(self.packages),
+            "excluded": {k: sorted(v) for k, v in sorted(self.excluded.items())},
+        }
+
+    def observe(self) -> Any:
+        if db := self._db():
+            return db.fingerprint()
+        return None
 
-        installed = self._get_explicitly_installed_packages()
-        target = self._resolve_packages(groups, self.packages)
+    def plan(self) -> Any:
+        db = self._db()
+        local = None if db is None else db.local_packages()
 
-        to_install = target - installed
-        to_uninstall = installed - target
+        if local is None:
+            installed = set(self._pacman_capture("-Qqe").splitlines())
+        else:
+            installed = {name for name, package in local.items() if package.explicit}
+        target = self.resolve().packages
+
+        return {
+            "target": sorted(target),
+            "install": sorted(target - installed),
+            "uninstall": sorted(installed - target),
+            "transactions": (
+                None if local is None else PacmanPlan.compute(local, target).to_json()
+            ),
+        }
+
+    def changes(self, plan: Any) -> list[str]:
+        return [f"+ {p}" for p in plan["install"]] + [
+            f"- {p}" for p in plan["uninstall"]
+        ]
 
-        for package in sorted(to_install):
+    def apply(self, plan: Any) -> None:
+        for package in plan["install"]:
             self.c.print(f"[bold green]+[/] {escape(package)}")
-        for package in sorted(to_uninstall):
+        for package in plan["uninstall"]:
             self.c.print(f"[bold red]-[/] {escape(package)}")
 
-        self._install_packages(to_install)
-        self._uninstall_packages(to_uninstall)
+        db = self._db()
+        if db is None or plan["transactions"] is None:
+            self._install_packages(set(plan["install"]))
+            self._uninstall_packages(set(plan["uninstall"]))
+        else:
+            transactions = PacmanPlan.from_json(plan["transactions"])
+            self._execute_plan(db, transactions, set(plan["target"]))
+
+    def _execute_plan(self, db: PacmanDb, plan: PacmanPlan, target: set[str]) -> None:
+        if self.o.dry_run:
+            transactions = plan.changes_before_removal()
+            if removal := plan.removal():
+                transactions.append(removal)
+            for args in transactions:
+                cmd = shlex.join(self._pacman_cmd(*args))
+                self.c.print(f"[bright_black]$ {escape(cmd)}  # dry run")
+            return
+
+        changes = plan.changes_before_removal()
+        for args in changes:
+            self._pacman_execute(*args)
+
+        # Newly installed packages may depend on packages that were orphans
+        # before, so the packages to remove must be determined again.
+        if changes:
+            plan = PacmanPlan.compute(db.local_packages(), target)
+
+        if removal := plan.removal():
+            self._pacman_execute(*removal)
 
     def _pacman_capture(self, *args: str) -> str:
-        return run_capture(self.binary, *args)
+        return run_capture(*self.o.transport.command((self.binary, *args)))
 
-    def _pacman_execute(self, *args: str) -> None:
+    def _pacman_cmd(self, *args: str) -> tuple[str, ...]:
+        # Nobody could answer pacman's questions
+        if not self.o.interactive:
+            args = ("--noconfirm", *args)
+        cmd = self.o.transport.command((self.binary, *args))
         if self.sudo:
-            run_execute("sudo", self.binary, *args)
-        else:
-            run_execute(self.binary, *args)
+            return ("sudo", *cmd)
+        return cmd
 
-    def _get_explicitly_installed_packages(self) -> set[str]:
-        return set(self._pacman_capture("-Qqe").splitlines())
+    def _pacman_execute(self, *args: str) -> None:
+        run_execute(*self._pacman_cmd(*args), interactive=self.o.interactive)
+
+    def _db(self) -> PacmanDb | None:
+        if not self.read_db:
+            return None
+        cache_path = self.o.state_dir / "pacman-groups.json"
+        db = PacmanDb(self.root, cache_path, save_cache=not self.o.dry_run)
+        if not db.available():
+            return None
+        return db
 
     def _get_groups(self) -> dict[str, set[str]]:
+        if db := self._db():
+            if (db_groups := db.groups()) is not None:
+                return db_groups
+
         groups: dict[str, set[str]] = {}
         for line in self._pacman_capture("-Sgg").splitlines():
             group, package = line.split(" ", maxsplit=1)
             groups.setdefault(group, set()).add(package)
         return groups
 
-    def _resolve_packages(
-        self,
-        groups: dict[str, set[str]],
-        packages: set[str],
-    ) -> set[str]:
-        result = set()
-        for package in packages:
-            result.update(self._resolve_package(groups, package))
-        return result
-
-    def _resolve_package(self, groups: dict[str, set[str]], package: str) -> set[str]:
-        packages = groups.get(package)
-        if packages is None:
-            return {package}
-        packages = packages - self.excluded.get(package, set())
-        return self._resolve_packages(groups, packages)
-
     def _install_packages(self, packages: set[str]) -> None:
         if self.o.dry_run:
             return
@@ -0,0 +1,188 @@
+import json
+import re
+from dataclasses import dataclass
+from pathlib import Path
+
+
+def parse_desc(text: str) -> dict[str, list[str]]:
+    """
+    Parse a pacman `desc` file, which consists of `%SECTION%` headers, each
+    followed by one value per line and terminated by an empty line.
+    """
+    result: dict[str, list[str]] = {}
+    values: list[str] | None = None
+    for line in text.splitlines():
+        if values is None:
+            if line.startswith("%") and line.endswith("%"):
+                values = result.setdefault(line[1:-1], [])
+        elif line:
+            values.append(line)
+        else:
+            values = None
+    return result
+
+
+def _strip_version(s: str) -> str:
+    # Dependencies and provisions may carry a version constraint like
+    # `foo>=1.0` or `libfoo.so=1-64`.
+    return re.split(r"[<>=]", s, maxsplit=1)[0]
+
+
+@dataclass
+class LocalPackage:
+    name: str
+    explicit: bool
+    depends: list[str]
+    provides: list[str]
+
+    @classmethod
+    def from_desc(cls, desc: dict[str, list[str]]) -> "LocalPackage":
+        return cls(
+            name=desc["NAME"][0],
+            # Packages installed as dependencies have a reason of 1. Explicitly
+            # installed packages have a reason of 0 or none at all.
+            explicit=desc.get("REASON", ["0"]) == ["0"],
+            depends=[_strip_version(d) for d in desc.get("DEPENDS", [])],
+            provides=[_strip_version(p) for p in desc.get("PROVIDES", [])],
+        )
+
+
+def required_packages(packages: dict[str, LocalPackage], roots: set[str]) -> set[str]:
+    """
+    All installed packages that are required by the installed roots, including
+    the roots themselves. Optional dependencies don't count, like for
+    `pacman -Qdtt`.
+    """
+    providers: dict[str, set[str]] = {}
+    for package in packages.values():
+        providers.setdefault(package.name, set()).add(package.name)
+        for provision in package.provides:
+            providers.setdefault(provision, set()).add(package.name)
+
+    result: set[str] = set()
+    todo = [root for root in roots if root in packages]
+    while todo:
+        name = todo.pop()
+        if name in result:
+            continue
+        result.add(name)
+        for dependency in packages[name].depends:
+            todo.extend(providers.get(dependency, set()))
+    return result
+
+
+class PacmanDb:
+    """
+    Reads package state directly from pacman's local and sync databases instead
+    of asking pacman, which is a lot faster than spawning it multiple times.
+
+    The group index is cached in a file and only rebuilt when the sync
+    databases change.
+    """
+
+    def __init__(
+        self,
+        root: Path,
+        cache_path: Path | None = None,
+        save_cache: bool = True,
+    ) -> None:
+        self.path = root / "var/lib/pacman"
+        self._cache_path = cache_path
+        self._save_cache = save_cache
+
+    def available(self) -> bool:
+        return (self.path / "local").is_dir() and (self.path / "sync").is_dir()
+
+    def local_packages(self) -> dict[str, LocalPackage]:
+        packages = {}
+        for entry in sorted((self.path / "local").iterdir()):
+            try:
+                text = (entry / "desc").read_text(encoding="utf-8")
+            except (FileNotFoundError, NotADirectoryError):
+                continue
+            desc = parse_desc(text)
+            if "NAME" in desc:
+                package = LocalPackage.from_desc(desc)
+                packages[package.name] = package
+        return packages
+
+    def fingerprint(self) -> list[object]:
+        """
+        Changes whenever packages are installed, removed or have their install
+        reason changed, which rewrites their `desc` file.
+        """
+        local = self.path / "local"
+        count = 0
+        latest = local.stat().st_mtime_ns
+        for desc in local.glob("*/desc"):
+            count += 1
+            latest = max(latest, desc.stat().st_mtime_ns)
+        return [count, latest, self._sync_key()]
+
+    def _sync_dbs(self) -> list[Path]:
+        return sorted((self.path / "sync").glob("*.db"))
+
+    def _sync_key(self) -> dict[str, int]:
+        return {db.name: db.stat().st_mtime_ns for db in self._sync_dbs()}
+
+    def _load_cached_groups(self, key: dict[str, int]) -> dict[str, set[str]] | None:
+        if self._cache_path is None:
+            return None
+        try:
+            data = json.loads(self._cache_path.read_text(encoding="utf-8"))
+        except (FileNotFoundError, ValueError):
+            return None
+        if type(data) is not dict or data.get("key") != key:
+            return None
+        return {group: set(packages) for group, packages in data["groups"].items()}
+
+    def _save_cached_groups(
+        self,
+        key: dict[str, int],
+        groups: dict[str, set[str]],
+    ) -> None:
+        if self._cache_path is None or not self._save_cache:
+            return
+        data = {
+            "key": key,
+            "groups": {group: sorted(pkgs) for group, pkgs in sorted(groups.items())},
+        }
+        self._cache_path.parent.mkdir(parents=True, exist_ok=True)
+        self._cache_path.write_text(json.dumps(data), encoding="utf-8")
+
+    def _read_sync_db(self, path: Path, groups: dict[str, set[str]]) -> None:
+        import tarfile
+
+        with tarfile.open(path, "r:*") as tar:
+            for member in tar:
+                if not member.isfile() or not member.name.endswith("/desc"):
+                    continue
+                f = tar.extractfile(member)
+                if f is None:
+                    continue
+                desc = parse_desc(f.read().decode("utf-8"))
+                for group in desc.get("GROUPS", []):
+                    groups.setdefault(group, set()).add(desc["NAME"][0])
+
+    def groups(self) -> dict[str, set[str]] | None:
+        """
+        All groups in the sync databases, or `None` if at least one database
+        could not be read (for example because it uses an unsupported
+        compression).
+        """
+        key = self._sync_key()
+        if (groups := self._load_cached_groups(key)) is not None:
+            return groups
+
+        # Only needed when the cache is stale
+        import tarfile
+
+        groups = {}
+        for db in self._sync_dbs():
+            try:
+                self._read_sync_db(db, groups)
+            except tarfile.ReadError:
+                return None
+
+        self._save_cached_groups(key, groups)
+        return groups
@@ -1,10 +1,53 @@
+import json
+import re
+from pathlib import Path
+from typing import Any
+
 from rich.markup import escape
 
 from pasch.file.json import JsonFile
-from pasch.modules.files import Files
+from pasch.modules.files import Files, stat_file
 from pasch.modules.pacman import Pacman
 from pasch.orchestrator import Module, Orchestrator
-from pasch.util import run_capture, run_execute
+
+
+def _read_extensions_json(path: Path) -> set[str] | None:
+    try:
+        data = json.loads((path / "extensions.json").read_text(encoding="utf-8"))
+    except (FileNotFoundError, ValueError):
+        return None
+    if type(data) is not list:
+        return None
+
+    # Uninstalled extensions are only marked as obsolete and removed later
+    try:
+        obsolete = json.loads((path / ".obsolete").read_text(encoding="utf-8"))
+    except (FileNotFoundError, ValueError):
+        obsolete = {}
+
+    extensions = set()
+    for entry in data:
+        try:
+            if entry.get("relativeLocation") in obsolete:
+                continue
+            extensions.add(entry["identifier"]["id"])
+        except (AttributeError, KeyError, TypeError):
+            return None
+    return extensions
+
+
+def _read_extension_dirs(path: Path) -> set[str] | None:
+    if not path.is_dir():
+        return None
+
+    extensions = set()
+    for manifest in path.glob("*/package.json"):
+        try:
+            data = json.loads(manifest.read_text(encoding="utf-8"))
+            extensions.add(f"{data['publisher']}.{data['name']}")
+        except (ValueError, KeyError, TypeError):
+            return None
+    return extensions
 
 
 class Vscode(Module):
@@ -24,6 +67,14 @@ class Vscode(Module):
 
         self.extensions: set[str] = set()
 
+        # Where the installed extensions are read from instead of asking
+        # `code`. Defaults to the extensions directory of the chosen flavour.
+        self.extensions_dir: Path | None = None
+
+        # A directory of `<id>.vsix` or `<id>-<version>.vsix` files to install
+        # extensions from instead of downloading them from the marketplace.
+        self.vsix_cache: Path | None = None
+
         self.settings = JsonFile()
         self.argv = JsonFile()
 
@@ -53,19 +104,91 @@ class Vscode(Module):
             self._files.add(".config/Code - OSS/User/settings.json", self.settings)
             self._files.add(".vscode-oss/argv.json", self.argv)
 
-    def execute(self) -> None:
-        installed = set(run_capture("code", "--list-extensions").splitlines())
-
-        to_install = self.extensions - installed
-        to_uninstall = installed - self.extensions
-
-        for package in sorted(to_install):
+    def _extensions_dir(self) -> Path:
+        if self.extensions_dir is not None:
+            return self.extensions_dir
+        home = self.o.home()
+        if self.microsoft:
+            return home / ".vscode/extensions"
+        return home / ".vscode-oss/extensions"
+
+    def _installed_extensions(self) -> set[str]:
+        path = self._extensions_dir()
+        installed = _read_extensions_json(path)
+        if installed is None:
+            installed = _read_extension_dirs(path)
+        if installed is None:
+            output = self.o.runner.capture("code", "--list-extensions")
+            installed = set(output.splitlines())
+        return installed
+
+    def _vsix(self, extension: str) -> str:
+        if self.vsix_cache is None:
+            return extension
+
+        # Extension names may contain dashes themselves, so only a version
+        # made of numbers may follow the id. The highest version is installed,
+        # an unversioned file only if there is no versioned one.
+        name_re = re.compile(
+            rf"{re.escape(extension)}(?:-(\d+(?:\.\d+)*))?\.vsix", re.IGNORECASE
+        )
+        candidates: dict[tuple[int, ...], Path] = {}
+        for path in self.vsix_cache.glob("*.vsix"):
+            if match := name_re.fullmatch(path.name):
+                version = match.group(1)
+                key = () if version is None else tuple(map(int, version.split(".")))
+                candidates[key] = path
+        if not candidates:
+            return extension
+        return str(candidates[max(candidates)])
+
+    def inputs(self) -> Any:
+        vsix = None
+        if self.vsix_cache is not None:
+            vsix = sorted(path.name for path in self.vsix_cache.glob("*.vsix"))
+        return {"extensions": sorted(self.extensions), "vsix": vsix}
+
+    def observe(self) -> Any:
+        path = self._extensions_dir()
+        stat = stat_file(path / "extensions.json") or stat_file(path)
+        return None if stat is None else list(stat)
+
+    def plan(self) -> Any:
+        # Extension ids are case-insensitive
+        wanted = {ext.lower(): ext for ext in self.extensions}
+        installed = {ext.lower(): ext for ext in self._installed_extensions()}
+
+        to_install = {wanted[ext] for ext in wanted.keys() - installed.keys()}
+        to_uninstall = {installed[ext] for ext in installed.keys() - wanted.keys()}
+        return {"install": sorted(to_install), "uninstall": sorted(to_uninstall)}
+
+    def changes(self, plan: Any) -> list[str]:
+        return [f"+ {e}" for e in plan["install"]] + [
+            f"- {e}" for e in plan["uninstall"]
+        ]
+
+    def apply(self, plan: Any) -> None:
+        to_install: list[str] = plan["install"]
+        to_uninstall: list[str] = plan["uninstall"]
+
+        for package in to_install:
             self.c.print(f"[bold green]+[/] {escape(package)}")
-        for package in sorted(to_uninstall):
+        for package in to_uninstall:
             self.c.print(f"[bold red]-[/] {escape(package)}")
 
-        for extension in sorted(to_install):
-            run_execute("code", "--install-extension", extension)
-
-        for extension in sorted(to_uninstall):
-            run_execute("code", "--uninstall-extension", extension)
+        if self.o.dry_run:
+            return
+
+        # Every invocation of `code` takes a while to start up, so all
+        # extensions are passed to a single invocation.
+        if to_install:
+            cmd = ["code"]
+            for extension in to_install:
+                cmd.extend(("--install-extension", self._vsix(extension)))
+            self.o.runner.run(tuple(cmd))
+
+        if to_uninstall:
+            cmd = ["code"]
+            for extension in to_uninstall:
+                cmd.extend(("--uninstall-extension", extension))
+            self.o.runner.run(tuple(cmd))
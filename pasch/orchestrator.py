@@ -1,26 +1,170 @@
 from __future__ import annotations
 
 import getpass
+import hashlib
+import json
 import socket
-from typing import Callable, Concatenate
+from collections.abc import Collection, Generator, Iterator
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Callable, Concatenate
 
 from rich.console import Console
 from rich.markup import escape
 from xdg_base_dirs import xdg_state_home
 
+from pasch.profile import Profiler, profiling, span
+from pasch.runner import Runner
+from pasch.transport import LocalTransport, Transport, TransportBackend
+from pasch.util import grouped_output, output_group
+
+if TYPE_CHECKING:
+    from concurrent.futures import Future
+
+    from pasch.store import ObjectStore
+
 
 class Module:
     def __init__(self, orchestrator: Orchestrator) -> None:
         self.o = orchestrator
         self.o.register(self)
         self.c = self.o.c
+        self.dependencies: list[Module] = []
+
+    def depends_on(self, *modules: Module) -> None:
+        """
+        Execute this module only after the given modules have been executed.
+
+        Modules passed to the constructor of another module are recognized as
+        its dependencies automatically.
+        """
+        self.dependencies.extend(modules)
 
     def configure(self) -> None:
         pass
 
-    def execute(self) -> None:
+    def inputs(self) -> Any:
+        """
+        A json-serializable description of the configured target state, or
+        `None` if the module can't describe it.
+        """
+        return None
+
+    def observe(self) -> Any:
+        """
+        A cheap, json-serializable fingerprint of the parts of the system the
+        module manages, or `None` if the module can't observe them.
+        """
+        return None
+
+    def plan(self) -> Any:
+        """
+        Compare the configured target state with the system and return a
+        json-serializable description of the required changes.
+        """
+        return None
+
+    def apply(self, plan: Any) -> None:
+        """
+        Apply changes previously returned by `plan()`.
+        """
         pass
 
+    def changes(self, plan: Any) -> list[str]:
+        """
+        Short descriptions of the changes in a plan returned by `plan()`, or an
+        empty list if the system is already in the target state.
+        """
+        return [] if not plan else [json.dumps(plan, sort_keys=True)]
+
+    def diff(self, plan: Any) -> None:
+        """
+        Print the changes in a plan returned by `plan()` in detail.
+        """
+        for change in self.changes(plan):
+            self.c.print(escape(change))
+
+    def converged(self) -> bool:
+        """
+        Whether the last `apply()` brought the system into the target state, as
+        opposed to skipping some changes, for example because the user
+        declined them.
+        """
+        return True
+
+    def execute(self) -> None:
+        self.apply(self.plan())
+
+
+class GenModule(Module):
+    """
+    A module configured by a generator, see `@module_gen`.
+
+    The generator yields a module, or a list of modules, to suspend until they
+    have been configured, and is sent back their outputs. What it returns
+    becomes the output of this module. The output of other modules is the
+    module itself.
+
+    Unlike other modules, generator-based modules are only configured if their
+    output is needed, either because another module yields them or because
+    they contribute to a module that is configured (by referencing it).
+    """
+
+    output: Any = None
+
+    def configure_gen(self) -> Generator[Any, Any, Any]:
+        # An empty generator
+        return
+        yield
+
+    def configure(self) -> None:
+        gen = self.configure_gen()
+        value = None
+        try:
+            while True:
+                request = gen.send(value)
+                if isinstance(request, Module):
+                    value = self.o.require(request)
+                elif isinstance(request, (list, tuple)) and all(
+                    isinstance(m, Module) for m in request
+                ):
+                    value = [self.o.require(m) for m in request]
+                else:
+                    name = type(self).__name__
+                    raise Exception(f"{name} yielded {request!r} instead of modules")
+        except StopIteration as e:
+            self.output = e.value
+
+
+def _executes(module: Module) -> bool:
+    cls = type(module)
+    return cls.execute is not Module.execute or cls.apply is not Module.apply
+
+
+def _hash_json(data: Any) -> str:
+    text = json.dumps(data, sort_keys=True, default=str)
+    return f"sha256-{hashlib.sha256(text.encode('utf-8')).hexdigest()}"
+
+
+@dataclass
+class Plan:
+    """
+    The changes all modules would make, as computed by `Orchestrator.plan()`.
+    """
+
+    # Fingerprint of the configured inputs the plan was computed from
+    inputs: str | None
+    modules: dict[str, Any]
+
+    def to_json(self) -> str:
+        return json.dumps(asdict(self), indent=2, sort_keys=True)
+
+    @classmethod
+    def from_json(cls, text: str) -> Plan:
+        data = json.loads(text)
+        return cls(inputs=data["inputs"], modules=data["modules"])
+
 
 def _snake_to_camel(s: str) -> str:
     return "".join(s.capitalize() for s in s.split("_"))
@@ -47,23 +191,142 @@ def module[**P](
     )
 
 
-# TODO @module_gen for generator-based modules
+# Annotate a generator function with @module_gen to turn it into a class
+# implementing GenModule.
+def module_gen[**P](
+    func: Callable[Concatenate[Orchestrator, P], Generator[Any, Any, Any]],
+) -> Callable[Concatenate[Orchestrator, P], GenModule]:
+    def __init__(self, o: Orchestrator, *args: P.args, **kwargs: P.kwargs) -> None:
+        super(self.__class__, self).__init__(o)
+        self.args = args
+        self.kwargs = kwargs
+
+    def configure_gen(self) -> Generator[Any, Any, Any]:
+        # pyrefly: ignore
+        return func(self.o, *self.args, **self.kwargs)
+
+    # pyrefly: ignore
+    return type(
+        _snake_to_camel(func.__name__),
+        (GenModule,),
+        {"__init__": __init__, "configure_gen": configure_gen},
+    )
+
+
+def _referenced_modules(value: object) -> list[Module]:
+    if isinstance(value, Module):
+        return [value]
+    if isinstance(value, (list, tuple)):
+        return [v for v in value if isinstance(v, Module)]
+    if isinstance(value, dict):
+        return [v for v in value.values() if isinstance(v, Module)]
+    return []
 
 
 class Orchestrator:
-    def __init__(self, name: str = "pasch", dry_run: bool = False) -> None:
+    def __init__(
+        self,
+        name: str = "pasch",
+        dry_run: bool = False,
+        jobs: int = 1,
+        profile: bool = False,
+        host: str | None = None,
+        user: str | None = None,
+        transport: Transport | None = None,
+        state_dir: Path | None = None,
+        interactive: bool = True,
+        only: Collection[str] | None = None,
+    ) -> None:
         self.name = name
+
+        # Plan and report changes without making any, which includes not
+        # updating the state pasch keeps about the system
         self.dry_run = dry_run
 
-        self.state_dir = xdg_state_home() / self.name
+        # Whether the user can be asked questions. If not, changes that would
+        # need confirmation are skipped.
+        self.interactive = interactive
+
+        # Execute up to this many independent modules concurrently
+        self.jobs = jobs
+
+        # How the managed system is reached, see `pasch.transport`
+        self.transport = transport or LocalTransport()
+
+        # For modules that want to run many commands at once
+        self.runner = Runner(
+            backend=None if transport is None else TransportBackend(transport)
+        )
+
+        # Contents of files to write by hash, provided in fleet mode so they
+        # don't have to be rendered again, see `pasch.fleet`
+        self.artifacts: ObjectStore | None = None
+
+        # Collect timings and counters, see `pasch.profile`
+        self.profiler = Profiler() if profile else None
+
+        # Only plan and execute the modules with these keys or class names, see
+        # `module_keys()`. Other modules are still configured.
+        self.only = None if only is None else set(only)
+
+        # Set by `realize(force=True)`. Modules should then reconcile
+        # everything they manage instead of only what changed since they last
+        # ran.
+        self.force = False
+
+        self.state_dir = state_dir or xdg_state_home() / self.name
         self.c = Console(highlight=False)
 
-        self.user = getpass.getuser()
-        self.host = socket.gethostname()
+        self.user = user or getpass.getuser()
+        self.host = host or socket.gethostname()
+
+        self._home: Path | None = None
 
         self._frozen: bool = False
         self._configured: bool = False
         self._modules: list[Module] = []
+        self._contributors: dict[int, list[Module]] = {}
+        self._configuring: set[int] = set()
+        self._configured_modules: set[int] = set()
+        self._plans: dict[str, Any] | None = None
+        # Modules executed by this orchestrator, in order
+        self._executed: list[Module] = []
+
+    def passwd(self) -> list[str] | None:
+        """
+        The fields of the user's entry in the host's passwd file, or None if
+        there is no entry or the file can't be read. Read on every call, so it
+        reflects changes made during the run.
+        """
+        try:
+            passwd = self.transport.path(Path("/etc/passwd")).read_text()
+        except OSError:
+            return None
+        for line in passwd.splitlines():
+            fields = line.split(":")
+            if len(fields) == 7 and fields[0] == self.user:
+                return fields
+        return None
+
+    def home(self) -> Path:
+        """
+        Where the user's home directory on the host can be accessed locally.
+        """
+        if self._home is not None:
+            return self._home
+
+        # The current user's home locally, which respects $HOME
+        if isinstance(self.transport, LocalTransport) and (
+            self.user == getpass.getuser()
+        ):
+            self._home = Path.home()
+            return self._home
+
+        entry = self.passwd()
+        if entry is None or not entry[5]:
+            raise Exception(f"can't find the home directory of {self.user}")
+        self._home = self.transport.path(Path(entry[5]))
+        return self._home
 
     def register(self, module: Module) -> None:
         if self._frozen:
@@ -76,24 +339,371 @@ class Orchestrator:
 
         self._frozen = True
 
+        # Modules referencing another module contribute to its configuration,
+        # so they have to be configured first. Generator-based modules are
+        # only read by yielding them, so nothing contributes to them.
+        self._contributors = {id(module): [] for module in self._modules}
+        for module in reversed(self._modules):
+            for dep in self.dependencies(module):
+                if not isinstance(dep, GenModule):
+                    self._contributors[id(dep)].append(module)
+
         self.c.print()
         self.c.print("[bold bright_cyan]# Configure")
         for module in reversed(self._modules):
-            self.c.print(f"[bold bright_magenta]\\[{escape(type(module).__name__)}]")
-            module.configure()
+            if not isinstance(module, GenModule):
+                self._require(module, explicit=False)
 
         self._configured = True
 
-    def execute(self) -> None:
+    def require(self, module: Module) -> Any:
+        """
+        Configure a module, and the modules contributing to it, unless that
+        already happened. Returns the output of the module.
+        """
+        return self._require(module, explicit=True)
+
+    def _require(self, module: Module, explicit: bool) -> Any:
+        if id(module) not in self._configured_modules:
+            name = type(module).__name__
+            if id(module) in self._configuring:
+                # Modules referencing each other are configured in
+                # registration order, like before configuration was on demand
+                if explicit:
+                    raise Exception(f"{name} is required while being configured")
+                return None
+
+            self._configuring.add(id(module))
+            for contributor in self._contributors.get(id(module), []):
+                self._require(contributor, explicit=False)
+
+            self.c.print(f"[bold bright_magenta]\\[{escape(name)}]")
+            with span(name, "configure"):
+                module.configure()
+            self._configuring.discard(id(module))
+            self._configured_modules.add(id(module))
+
+        return module.output if isinstance(module, GenModule) else module
+
+    def module_keys(self) -> dict[str, Module]:
+        """
+        Unique names for all modules, used as keys in plans.
+        """
+        keys: dict[str, Module] = {}
+        counts: dict[str, int] = {}
+        for module in self._modules:
+            name = type(module).__name__
+            counts[name] = counts.get(name, 0) + 1
+            key = name if counts[name] == 1 else f"{name}#{counts[name]}"
+            keys[key] = module
+        return keys
+
+    def unknown_modules(self) -> list[str]:
+        """
+        The names in `only` that match neither the key nor the class name of any
+        module.
+        """
+        keys = self.module_keys()
+        known = {k.casefold() for k in keys} | {
+            type(m).__name__.casefold() for m in keys.values()
+        }
+        return sorted(name for name in self.only or [] if name.casefold() not in known)
+
+    def selected(self) -> dict[str, Module]:
+        """
+        The modules to plan and execute by their keys, see `only`.
+        """
+        keys = self.module_keys()
+        if self.only is None:
+            return keys
+
+        if unknown := self.unknown_modules():
+            raise Exception(f"unknown modules {', '.join(unknown)}")
+        names = {name.casefold() for name in self.only}
+        return {
+            key: module
+            for key, module in keys.items()
+            if key.casefold() in names or type(module).__name__.casefold() in names
+        }
+
+    def _fingerprint(self, observe: bool) -> str | None:
+        data = {}
+        for key, module in self.selected().items():
+            if not _executes(module):
+                continue
+            inputs = module.inputs()
+            observed = module.observe() if observe else {}
+            if inputs is None or observed is None:
+                return None
+            data[key] = [inputs, observed]
+        return _hash_json(data)
+
+    def _module_fingerprint(self, module: Module) -> str | None:
+        inputs = module.inputs()
+        observed = module.observe()
+        if inputs is None or observed is None:
+            return None
+        return _hash_json([inputs, observed])
+
+    def outdated(self) -> list[Module]:
+        """
+        The selected modules that have to be executed, because their config or
+        the parts of the system they manage changed since they were last
+        executed successfully, or because a module they depend on has to be
+        executed.
+        """
+        saved = self._load_fingerprints()
+        outdated = set()
+        for key, module in self.selected().items():
+            if not _executes(module):
+                continue
+            fingerprint = self._module_fingerprint(module)
+            if fingerprint is None or fingerprint != saved.get(key):
+                outdated.add(id(module))
+
+        # Modules may build on what the modules they depend on do
+        dependencies = {id(m): self.dependencies(m) for m in self._modules}
+        changed = True
+        while changed:
+            changed = False
+            for module in self._modules:
+                if id(module) not in outdated and any(
+                    id(dep) in outdated for dep in dependencies[id(module)]
+                ):
+                    outdated.add(id(module))
+                    changed = True
+
+        return [
+            module
+            for module in self.selected().values()
+            if _executes(module) and id(module) in outdated
+        ]
+
+    def dependencies(self, module: Module) -> list[Module]:
+        result = list(module.dependencies)
+        for value in vars(module).values():
+            result.extend(_referenced_modules(value))
+        return [dep for dep in result if dep is not module and dep in self._modules]
+
+    def execute(self, modules: list[Module] | None = None) -> None:
+        """
+        Execute the given modules, or all selected modules.
+        """
         if not self._configured:
             raise Exception("executing an unconfigured orchestrator")
 
+        if modules is None:
+            modules = list(self.selected().values())
+
         self.c.print()
         self.c.print("[bold bright_cyan]# Execute")
-        for module in self._modules:
-            self.c.print(f"[bold bright_magenta]\\[{escape(type(module).__name__)}]")
-            module.execute()
+        if self.jobs > 1:
+            self._execute_concurrently(modules)
+        else:
+            for module in modules:
+                self._execute_module(module)
+        self._executed.extend(modules)
+
+    def _execute_module(self, module: Module) -> None:
+        name = type(module).__name__
+        self.c.print(f"[bold bright_magenta]\\[{escape(name)}]")
+        with span(name, "execute"):
+            if self._plans is None:
+                module.execute()
+                return
+
+            key = next(k for k, m in self.module_keys().items() if m is module)
+            plan = self._plans.get(key)
+            if plan is None:
+                module.execute()
+            else:
+                module.apply(plan)
+
+    def _execute_module_grouped(self, module: Module) -> None:
+        with output_group():
+            self._execute_module(module)
 
-    def realize(self) -> None:
+    def _execute_concurrently(self, modules: list[Module]) -> None:
+        from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+        pending = list(modules)
+        # Modules that aren't executed can't be waited for
+        dependencies = {
+            id(m): [dep for dep in self.dependencies(m) if dep in pending]
+            for m in pending
+        }
+        done: set[int] = set()
+        running: dict[Future[None], Module] = {}
+        error: BaseException | None = None
+
+        with grouped_output(), ThreadPoolExecutor(max_workers=self.jobs) as executor:
+            while pending or running:
+                if error is None:
+                    for module in list(pending):
+                        if all(id(dep) in done for dep in dependencies[id(module)]):
+                            pending.remove(module)
+                            future = executor.submit(
+                                self._execute_module_grouped, module
+                            )
+                            running[future] = module
+
+                if not running:
+                    if error is None:
+                        names = ", ".join(type(m).__name__ for m in pending)
+                        error = Exception(f"dependency cycle between modules {names}")
+                    break
+
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    module = running.pop(future)
+                    if (e := future.exception()) is not None:
+                        error = error or e
+                    else:
+                        done.add(id(module))
+
+        if error is not None:
+            raise error
+
+    def plan(self, modules: list[Module] | None = None) -> Plan:
+        """
+        Plan the given modules, or all selected modules.
+        """
+        if not self._configured:
+            raise Exception("planning an unconfigured orchestrator")
+
+        plans = {}
+        for key, module in self.selected().items():
+            if _executes(module) and (modules is None or module in modules):
+                plans[key] = module.plan()
+        return Plan(self._fingerprint(observe=False), plans)
+
+    def _state_path(self) -> Path:
+        return self.state_dir / "state.json"
+
+    def _load_fingerprints(self) -> dict[str, str]:
+        try:
+            data = json.loads(self._state_path().read_text(encoding="utf-8"))
+        except (FileNotFoundError, ValueError):
+            return {}
+        # Older states only stored a single fingerprint for all modules
+        if type(data) is not dict or type(data.get("modules")) is not dict:
+            return {}
+        return {k: v for k, v in data["modules"].items() if type(v) is str}
+
+    def _save_fingerprints(self) -> None:
+        """
+        Remember the fingerprints of the modules executed in this run that were
+        brought into their target state.
+        """
+        if self.dry_run:
+            return
+
+        # Modules that weren't executed keep their fingerprint, even if other
+        # modules changed what they observe, so such changes aren't missed.
+        keys = self.module_keys()
+        fingerprints = {k: v for k, v in self._load_fingerprints().items() if k in keys}
+        executed = {id(m) for m in self._executed}
+        for key, module in keys.items():
+            if id(module) not in executed:
+                continue
+            fingerprint = None
+            if module.converged():
+                fingerprint = self._module_fingerprint(module)
+            if fingerprint is None:
+                fingerprints.pop(key, None)
+            else:
+                fingerprints[key] = fingerprint
+
+        # pasch.modules.files imports this module
+        from pasch.modules.files import atomic_write
+
+        path = self._state_path()
+        path.parent.mkdir(parents=True, exist_ok=True)
+        data = {"modules": fingerprints}
+        atomic_write(path, json.dumps(data, indent=2, sort_keys=True).encode())
+
+    def converged(self) -> bool:
+        """
+        Whether the last execution brought all modules into their target state.
+        """
+        return all(module.converged() for module in self.selected().values())
+
+    def up_to_date(self) -> bool:
+        """
+        Whether neither the config nor the system changed since the selected
+        modules were last executed successfully, meaning nothing needs to be
+        done.
+        """
+        return not self.outdated()
+
+    def save_plan(self, plan: Plan, path: Path | None = None) -> Path:
+        path = path or self.state_dir / "plan.json"
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(plan.to_json(), encoding="utf-8")
+        return path
+
+    @contextmanager
+    def _profiling(self) -> Iterator[None]:
+        if self.profiler is None:
+            yield
+            return
+
+        try:
+            with profiling(self.profiler):
+                yield
+        finally:
+            path = self.state_dir / "profile.json"
+            self.profiler.save(path)
+            self.c.print()
+            self.c.print("[bold bright_cyan]# Profile")
+            self.profiler.print_summary(self.c)
+            self.c.print(f"Trace written to {escape(str(path))}")
+
+    def apply(self, path: Path | None = None) -> None:
+        """
+        Execute a plan previously saved with `save_plan()` instead of computing
+        a new one. The plan must have been computed from the same config.
+        """
+        with self._profiling():
+            self._apply(path)
+
+    def _apply(self, path: Path | None) -> None:
+        plan = Plan.from_json((path or self.state_dir / "plan.json").read_text())
+        self.apply_plan(plan)
+
+    def apply_plan(self, plan: Plan) -> None:
+        """
+        Like `apply()`, but for a plan that has already been loaded.
+        """
+        if not self._configured:
+            self.configure()
+        if plan.inputs is None or plan.inputs != self._fingerprint(observe=False):
+            raise Exception("plan was computed from a different config")
+
+        self._plans = plan.modules
+        modules = [m for k, m in self.selected().items() if k in plan.modules]
+        try:
+            self.execute(modules)
+        finally:
+            self._plans = None
+        self._save_fingerprints()
+
+    def realize(self, force: bool = False) -> None:
+        with self._profiling():
+            self._realize(force)
+
+    def _realize(self, force: bool) -> None:
+        self.force = force
         self.configure()
-        self.execute()
+
+        # Only modules whose config or system changed since they last ran need
+        # to be executed, unless a full reconcile is forced
+        if force:
+            self.execute()
+        elif modules := self.outdated():
+            self.execute(modules)
+        else:
+            self.c.print()
+            self.c.print("[bold bright_cyan]# Up to date")
+            return
+        self._save_fingerprints()
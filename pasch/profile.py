@@ -0,0 +1,157 @@
+from __future__ import annotations
+
+import json
+import os
+import threading
+import time
+from collections.abc import Iterator
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import TYPE_CHECKING, Any
+
+from rich.markup import escape
+
+if TYPE_CHECKING:
+    from rich.console import Console
+
+
+@dataclass
+class Span:
+    name: str
+    category: str
+    start_ns: int
+    duration_ns: int
+    thread: int
+    args: dict[str, Any] = field(default_factory=dict)
+
+
+class Profiler:
+    """
+    Collects timing spans and counters during a run. Spans are exported in the
+    Chrome trace event format, so they can be inspected with `about:tracing` or
+    <https://ui.perfetto.dev>.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._origin_ns = time.perf_counter_ns()
+        self.spans: list[Span] = []
+        self.counters: dict[str, int] = {}
+
+    @contextmanager
+    def span(self, name: str, category: str, **args: Any) -> Iterator[dict[str, Any]]:
+        start_ns = time.perf_counter_ns()
+        try:
+            yield args
+        finally:
+            span = Span(
+                name=name,
+                category=category,
+                start_ns=start_ns - self._origin_ns,
+                duration_ns=time.perf_counter_ns() - start_ns,
+                thread=threading.get_ident(),
+                args=args,
+            )
+            with self._lock:
+                self.spans.append(span)
+
+    def count(self, name: str, value: int = 1) -> None:
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def to_json(self) -> dict[str, Any]:
+        events = [
+            {
+                "name": span.name,
+                "cat": span.category,
+                "ph": "X",
+                "ts": span.start_ns / 1000,
+                "dur": span.duration_ns / 1000,
+                "pid": os.getpid(),
+                "tid": span.thread,
+                "args": span.args,
+            }
+            for span in self.spans
+        ]
+        return {"traceEvents": events, "counters": dict(sorted(self.counters.items()))}
+
+    def save(self, path: Path) -> None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(json.dumps(self.to_json(), indent=2), encoding="utf-8")
+
+    def print_summary(self, c: Console) -> None:
+        from rich.table import Table
+
+        modules = Table("Module", "Configure", "Execute", title="Modules")
+        times: dict[str, dict[str, int]] = {}
+        for span in self.spans:
+            if span.category in {"configure", "execute"}:
+                module = times.setdefault(span.name, {})
+                module[span.category] = module.get(span.category, 0) + span.duration_ns
+        for name, module in times.items():
+            modules.add_row(
+                escape(name),
+                _fmt_ns(module.get("configure")),
+                _fmt_ns(module.get("execute")),
+            )
+        c.print(modules)
+
+        commands = Table("Command", "Duration", "Exit code", title="Subprocesses")
+        for span in self.spans:
+            if span.category == "subprocess":
+                commands.add_row(
+                    escape(span.name),
+                    _fmt_ns(span.duration_ns),
+                    str(span.args.get("returncode", "")),
+                )
+        if commands.row_count:
+            c.print(commands)
+
+        counters = Table("Counter", "Value", title="Counters")
+        for name, value in sorted(self.counters.items()):
+            counters.add_row(escape(name), str(value))
+        if counters.row_count:
+            c.print(counters)
+
+
+def _fmt_ns(ns: int | None) -> str:
+    if ns is None:
+        return ""
+    return f"{ns / 1_000_000:.1f} ms"
+
+
+_active: Profiler | None = None
+
+
+@contextmanager
+def profiling(profiler: Profiler | None) -> Iterator[None]:
+    """
+    Make the profiler collect all spans and counters reported while the
+    context is active. Does nothing if the profiler is `None`.
+    """
+    global _active
+    previous = _active
+    _active = profiler or previous
+    try:
+        yield
+    finally:
+        _active = previous
+
+
+@contextmanager
+def span(name: str, category: str, **args: Any) -> Iterator[dict[str, Any]]:
+    """
+    Time the context if profiling is active. The yielded dict can be used to
+    attach additional information, like an exit code, to the span.
+    """
+    if _active is None:
+        yield args
+        return
+    with _active.span(name, category, **args) as span_args:
+        yield span_args
+
+
+def count(name: str, value: int = 1) -> None:
+    if _active is not None:
+        _active.count(name, value)
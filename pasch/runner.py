@@ -0,0 +1,262 @@
+from __future__ import annotations
+
+import contextlib
+import json
+import shlex
+import subprocess
+from abc import ABC, abstractmethod
+from collections.abc import Callable, Sequence
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+from rich import print
+from rich.markup import escape
+
+from pasch.profile import span
+
+# asyncio takes a while to import, so it is only imported once commands run
+if TYPE_CHECKING:
+    import asyncio
+
+type Cmd = tuple[str, ...]
+type LineCallback = Callable[[str, str], None]
+
+
+@dataclass
+class CommandResult:
+    cmd: Cmd
+    returncode: int
+    stdout: str
+    stderr: str
+
+    def check(self) -> None:
+        if self.returncode != 0:
+            raise subprocess.CalledProcessError(
+                self.returncode, self.cmd, self.stdout, self.stderr
+            )
+
+
+class Backend(ABC):
+    @abstractmethod
+    async def run(
+        self,
+        cmd: Cmd,
+        on_line: LineCallback,
+        timeout: float | None,
+    ) -> CommandResult: ...
+
+
+class SubprocessBackend(Backend):
+    async def _read_lines(
+        self,
+        stream: asyncio.StreamReader,
+        name: str,
+        on_line: LineCallback,
+    ) -> str:
+        lines = []
+        while line := await stream.readline():
+            text = line.decode("utf-8", errors="replace")
+            lines.append(text)
+            on_line(name, text.rstrip("\n"))
+        return "".join(lines)
+
+    async def _kill(self, process: asyncio.subprocess.Process) -> None:
+        with contextlib.suppress(ProcessLookupError):
+            process.kill()
+        await process.wait()
+
+    async def run(
+        self,
+        cmd: Cmd,
+        on_line: LineCallback,
+        timeout: float | None,
+    ) -> CommandResult:
+        import asyncio
+
+        process = await asyncio.create_subprocess_exec(
+            *cmd,
+            stdin=asyncio.subprocess.DEVNULL,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+        )
+        assert process.stdout is not None
+        assert process.stderr is not None
+
+        try:
+            async with asyncio.timeout(timeout):
+                stdout, stderr = await asyncio.gather(
+                    self._read_lines(process.stdout, "stdout", on_line),
+                    self._read_lines(process.stderr, "stderr", on_line),
+                )
+                returncode = await process.wait()
+        except TimeoutError:
+            await self._kill(process)
+            raise subprocess.TimeoutExpired(list(cmd), timeout or 0) from None
+        except BaseException:
+            # Cancelled, for example because another command failed
+            await self._kill(process)
+            raise
+
+        return CommandResult(cmd, returncode, stdout, stderr)
+
+
+class RecordingBackend(Backend):
+    """
+    Runs commands using another backend and appends their results to a file,
+    which can later be used by a `ReplayBackend`.
+    """
+
+    def __init__(self, path: Path, backend: Backend | None = None) -> None:
+        self._path = path
+        self._backend = backend or SubprocessBackend()
+
+    async def run(
+        self,
+        cmd: Cmd,
+        on_line: LineCallback,
+        timeout: float | None,
+    ) -> CommandResult:
+        result = await self._backend.run(cmd, on_line, timeout)
+        with open(self._path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(asdict(result)) + "\n")
+        return result
+
+
+class ReplayBackend(Backend):
+    """
+    Replays results recorded by a `RecordingBackend` instead of running any
+    commands. Results for the same command are replayed in recording order.
+    """
+
+    def __init__(self, path: Path) -> None:
+        self._results: dict[Cmd, list[CommandResult]] = {}
+        for line in path.read_text(encoding="utf-8").splitlines():
+            data = json.loads(line)
+            result = CommandResult(
+                cmd=tuple(data["cmd"]),
+                returncode=data["returncode"],
+                stdout=data["stdout"],
+                stderr=data["stderr"],
+            )
+            self._results.setdefault(result.cmd, []).append(result)
+
+    async def run(
+        self,
+        cmd: Cmd,
+        on_line: LineCallback,
+        timeout: float | None,
+    ) -> CommandResult:
+        results = self._results.get(cmd)
+        if not results:
+            raise Exception(f"no recorded result for {shlex.join(cmd)}")
+        result = results.pop(0)
+        for line in result.stdout.splitlines():
+            on_line("stdout", line)
+        for line in result.stderr.splitlines():
+            on_line("stderr", line)
+        return result
+
+
+class Runner:
+    """
+    Runs multiple commands concurrently using asyncio, while limiting how many
+    commands run at the same time.
+
+    Output is printed line by line as it arrives, with each line prefixed by
+    a label for the command it belongs to. The label defaults to the name of
+    the program.
+    """
+
+    def __init__(
+        self,
+        limit: int = 4,
+        timeout: float | None = None,
+        backend: Backend | None = None,
+    ) -> None:
+        self.limit = limit
+        self.timeout = timeout
+        self.backend = backend or SubprocessBackend()
+
+    def _printer(self, prefix: str, quiet: bool) -> LineCallback:
+        def on_line(stream: str, line: str) -> None:
+            if quiet:
+                return
+            style = "red" if stream == "stderr" else "bright_black"
+            print(f"[{style}]{escape(prefix)} |[/] {escape(line)}")
+
+        return on_line
+
+    async def _run(
+        self,
+        semaphore: asyncio.Semaphore,
+        cmd: Cmd,
+        label: str | None,
+        quiet: bool,
+    ) -> CommandResult:
+        async with semaphore:
+            print(f"[bright_black]$ {escape(shlex.join(cmd))}")
+            on_line = self._printer(label or Path(cmd[0]).name, quiet)
+            with span(shlex.join(cmd), "subprocess") as info:
+                result = await self.backend.run(cmd, on_line, self.timeout)
+                info["returncode"] = result.returncode
+            return result
+
+    async def run_async(
+        self,
+        *cmds: Cmd,
+        check: bool = True,
+        quiet: bool = False,
+        labels: Sequence[str] | None = None,
+    ) -> list[CommandResult]:
+        import asyncio
+
+        if labels is not None and len(labels) != len(cmds):
+            raise ValueError("need one label per command")
+
+        semaphore = asyncio.Semaphore(self.limit)
+        tasks = [
+            asyncio.ensure_future(
+                self._run(semaphore, cmd, None if labels is None else labels[i], quiet)
+            )
+            for i, cmd in enumerate(cmds)
+        ]
+        try:
+            results = await asyncio.gather(*tasks)
+        except BaseException:
+            # Don't leave the other commands running, their processes are
+            # killed once their tasks are cancelled
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
+        if check:
+            for result in results:
+                result.check()
+        return results
+
+    def run(
+        self,
+        *cmds: Cmd,
+        check: bool = True,
+        quiet: bool = False,
+        labels: Sequence[str] | None = None,
+    ) -> list[CommandResult]:
+        """
+        Run the commands concurrently and return their results in order.
+
+        If `check` is set, a `CalledProcessError` is raised once all commands
+        have finished if any of them failed. If `quiet` is set, the output of
+        the commands is captured but not printed. `labels` replaces the program
+        names as the prefixes of the commands' output.
+
+        If a command can't be run or times out, the other commands are killed.
+        """
+        import asyncio
+
+        return asyncio.run(
+            self.run_async(*cmds, check=check, quiet=quiet, labels=labels)
+        )
+
+    def capture(self, *cmd: str) -> str:
+        return self.run(cmd, quiet=True)[0].stdout
@@ -0,0 +1,263 @@
+import json
+import zlib
+from dataclasses import asdict, dataclass, field
+from datetime import datetime
+from pathlib import Path
+
+from pasch.file.file import hash_bytes
+from pasch.modules.files import (
+    DirSync,
+    atomic_copy,
+    atomic_write,
+    copy_fd,
+    hash_file,
+    random_tmp_path,
+    remove_tmp_files,
+)
+
+# Appended to the path of objects that are stored compressed
+_COMPRESSED_SUFFIX = ".z"
+
+
+class ObjectStore:
+    """
+    A content-addressed store of file contents, keyed by the hashes produced by
+    `File.digest()`. Storing the same contents again is free.
+
+    Objects are stored as plain files by default, so restoring one is a copy
+    the file system can turn into a reflink. Compressed stores use less space,
+    but have to decompress objects to restore them.
+    """
+
+    def __init__(self, path: Path, compress: bool = False) -> None:
+        self.path = path
+        self.compress = compress
+
+    def object_path(self, hash: str) -> Path:
+        algorithm, _, digest = hash.partition("-")
+        if not digest or "/" in hash:
+            raise ValueError(f"invalid object hash {hash!r}")
+        return self.path / algorithm / digest[:2] / digest
+
+    def _compressed_path(self, hash: str) -> Path:
+        path = self.object_path(hash)
+        return path.with_name(path.name + _COMPRESSED_SUFFIX)
+
+    def has(self, hash: str) -> bool:
+        return self.object_path(hash).is_file() or self._compressed_path(hash).is_file()
+
+    def _write(self, hash: str, data: bytes) -> None:
+        if self.compress:
+            path = self._compressed_path(hash)
+            data = zlib.compress(data)
+        else:
+            path = self.object_path(hash)
+        atomic_write(path, data)
+
+    def put(self, data: bytes) -> str:
+        hash = hash_bytes(data)
+        if not self.has(hash):
+            self._write(hash, data)
+        return hash
+
+    def put_file(self, path: Path, hash: str | None = None) -> str | None:
+        """
+        Store the contents of a file and return their hash, or None if the file
+        doesn't exist. If the file's hash is already known, it can be passed to
+        skip hashing it again.
+        """
+        if hash is not None and self.has(hash):
+            return hash
+
+        # Otherwise the copy is hashed instead of the file, so the object matches
+        # its hash even if the file is modified while we copy it
+        self.path.mkdir(parents=True, exist_ok=True)
+        tmp_path = random_tmp_path(self.path / "object")
+        try:
+            try:
+                with open(path, "rb") as src, open(tmp_path, "xb") as dst:
+                    copy_fd(src.fileno(), dst.fileno())
+            except FileNotFoundError:
+                return None
+
+            if hash is None:
+                hash = hash_file(tmp_path)
+                assert hash is not None
+            if self.has(hash):
+                pass
+            elif self.compress:
+                self._write(hash, tmp_path.read_bytes())
+            else:
+                object_path = self.object_path(hash)
+                object_path.parent.mkdir(parents=True, exist_ok=True)
+                tmp_path.rename(object_path)
+        finally:
+            tmp_path.unlink(missing_ok=True)
+        return hash
+
+    def read(self, hash: str) -> bytes:
+        try:
+            return self.object_path(hash).read_bytes()
+        except FileNotFoundError:
+            return zlib.decompress(self._compressed_path(hash).read_bytes())
+
+    def restore(self, hash: str, path: Path, sync: DirSync | None = None) -> None:
+        """
+        Atomically replace the file at `path` with the object's contents.
+        """
+        object_path = self.object_path(hash)
+        if object_path.is_file():
+            atomic_copy(path, object_path, sync)
+        else:
+            atomic_write(path, self.read(hash), sync)
+
+    def hashes(self) -> set[str]:
+        """
+        The hashes of all stored objects.
+        """
+        hashes = set()
+        for path in self.path.glob("*/*/*"):
+            # Temporary files are hidden
+            if not path.name.startswith("."):
+                name = path.name.removesuffix(_COMPRESSED_SUFFIX)
+                hashes.add(f"{path.parent.parent.name}-{name}")
+        return hashes
+
+    def remove(self, hashes: set[str]) -> int:
+        """
+        Remove the objects with the given hashes. Returns the bytes freed.
+        """
+        # Copies left behind by interrupted runs
+        remove_tmp_files(self.path)
+
+        freed = 0
+        for hash in hashes:
+            for path in (self.object_path(hash), self._compressed_path(hash)):
+                try:
+                    freed += path.stat().st_size
+                    path.unlink()
+                except FileNotFoundError:
+                    continue
+                try:
+                    path.parent.rmdir()
+                except OSError:
+                    pass
+        return freed
+
+
+@dataclass
+class Generation:
+    id: int
+    time: str
+    # The hash of every managed file after the run
+    files: dict[str, str]
+    # The managed files that were executable after the run
+    executable: list[str] = field(default_factory=list)
+    # The contents of the files the run replaced or removed, including changes
+    # made by the user, or None if the file didn't exist before
+    previous: dict[str, str | None] = field(default_factory=dict)
+
+    @classmethod
+    def from_json(cls, data: object) -> "Generation":
+        if (
+            type(data) is not dict
+            or type(data.get("id")) is not int
+            or type(data.get("time")) is not str
+            or type(data.get("files")) is not dict
+        ):
+            raise ValueError("generation log contains an invalid entry")
+        return cls(
+            data["id"],
+            data["time"],
+            data["files"],
+            data.get("executable", []),
+            data.get("previous", {}),
+        )
+
+    def hashes(self) -> set[str]:
+        hashes = set(self.files.values())
+        hashes.update(h for h in self.previous.values() if h is not None)
+        return hashes
+
+
+class GenerationLog:
+    """
+    Records the managed files after every run that changed them, one json
+    object per line. Only the most recent generations are kept.
+    """
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+
+    def _lines(self) -> list[str]:
+        try:
+            return self.path.read_text(encoding="utf-8").splitlines()
+        except FileNotFoundError:
+            return []
+
+    def _parse(self, lines: list[str]) -> list[Generation]:
+        generations = []
+        for line in lines:
+            try:
+                data = json.loads(line)
+            except ValueError:
+                break  # Torn write at the end of the log
+            generations.append(Generation.from_json(data))
+        return generations
+
+    def load(self) -> list[Generation]:
+        return self._parse(self._lines())
+
+    def last(self) -> Generation | None:
+        # Only the last generation needs to be parsed
+        for line in reversed(self._lines()):
+            if generations := self._parse([line]):
+                return generations[0]
+        return None
+
+    def get(self, id: int) -> Generation:
+        for generation in self.load():
+            if generation.id == id:
+                return generation
+        raise ValueError(f"unknown generation {id}")
+
+    def append(
+        self,
+        files: dict[str, str],
+        executable: list[str],
+        previous: dict[str, str | None],
+    ) -> Generation:
+        last = self.last()
+        generation = Generation(
+            id=last.id + 1 if last is not None else 1,
+            time=datetime.now().astimezone().isoformat(timespec="seconds"),
+            files=files,
+            executable=executable,
+            previous=previous,
+        )
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(asdict(generation)) + "\n")
+        return generation
+
+    def prune(self, keep: int) -> set[str]:
+        """
+        Drop all but the last `keep` generations. Returns the hashes that only
+        the dropped generations referenced.
+        """
+        lines = self._lines()
+        if len(lines) <= keep:
+            return set()
+
+        dropped = self._parse(lines[: len(lines) - keep] if keep > 0 else lines)
+        kept = self._parse(lines[-keep:]) if keep > 0 else []
+        if kept:
+            text = "".join(json.dumps(asdict(g)) + "\n" for g in kept)
+            atomic_write(self.path, text.encode("utf-8"))
+        else:
+            self.path.unlink(missing_ok=True)
+
+        unreferenced = set().union(*(g.hashes() for g in dropped))
+        for generation in kept:
+            unreferenced -= generation.hashes()
+        return unreferenced
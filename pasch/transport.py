@@ -0,0 +1,74 @@
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from pathlib import Path
+
+from pasch.runner import Backend, Cmd, CommandResult, LineCallback, SubprocessBackend
+
+
+class Transport(ABC):
+    """
+    How the system of a host is reached from the machine running pasch.
+
+    In fleet mode, transports are sent to worker processes, so they must be
+    picklable.
+    """
+
+    @abstractmethod
+    def path(self, path: Path) -> Path:
+        """
+        Where the absolute `path` on the host can be accessed locally.
+        """
+        ...
+
+    @abstractmethod
+    def command(self, cmd: Cmd) -> Cmd:
+        """
+        A local command that runs `cmd` on the host.
+        """
+        ...
+
+
+class LocalTransport(Transport):
+    def path(self, path: Path) -> Path:
+        return path
+
+    def command(self, cmd: Cmd) -> Cmd:
+        return cmd
+
+
+@dataclass
+class ChrootTransport(Transport):
+    """
+    A host whose root file system is a directory on this machine, like a
+    container image or a system being installed. Running commands requires
+    permission to `chroot`.
+    """
+
+    root: Path
+
+    def path(self, path: Path) -> Path:
+        return self.root / path.relative_to("/")
+
+    def command(self, cmd: Cmd) -> Cmd:
+        return ("chroot", str(self.root), *cmd)
+
+
+class TransportBackend(Backend):
+    """
+    Runs the commands of a `Runner` on the host of a transport.
+    """
+
+    def __init__(self, transport: Transport, backend: Backend | None = None) -> None:
+        self._transport = transport
+        self._backend = backend or SubprocessBackend()
+
+    async def run(
+        self,
+        cmd: Cmd,
+        on_line: LineCallback,
+        timeout: float | None,
+    ) -> CommandResult:
+        result = await self._backend.run(self._transport.command(cmd), on_line, timeout)
+        # Report the command as it was requested, not how it was transported
+        result.cmd = cmd
+        return result
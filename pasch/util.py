@@ -1,24 +1,147 @@
-import difflib
+from __future__ import annotations
+
+import io
 import shlex
 import subprocess
+import sys
+import threading
+from collections.abc import Iterator
+from contextlib import contextmanager
+from typing import TYPE_CHECKING, Any, TextIO
 
 from rich import print
 from rich.markup import escape
-from rich.syntax import Syntax
 
+from pasch.profile import span
+
+if TYPE_CHECKING:
+    from rich.syntax import Syntax
+
+# Output groups collect everything a thread writes to stdout and only print it
+# once the group is finished, so the output of concurrently running modules
+# doesn't get interleaved. Interactions with the user temporarily bypass the
+# group and are serialized by a single lock.
+_interaction_lock = threading.RLock()
+_local = threading.local()
+
+
+def _group_buffer() -> io.StringIO | None:
+    return getattr(_local, "buffer", None)
+
+
+class _GroupedStdout:
+    def __init__(self, file: TextIO) -> None:
+        self._file = file
+        self.encoding = file.encoding
+
+    def _target(self) -> TextIO:
+        return _group_buffer() or self._file
+
+    def write(self, s: str) -> int:
+        return self._target().write(s)
+
+    def flush(self) -> None:
+        self._target().flush()
+
+    def isatty(self) -> bool:
+        return self._file.isatty()
+
+    def fileno(self) -> int:
+        return self._file.fileno()
+
+
+@contextmanager
+def grouped_output() -> Iterator[None]:
+    stdout = sys.stdout
+    # pyrefly: ignore
+    sys.stdout = _GroupedStdout(stdout)
+    try:
+        yield
+    finally:
+        sys.stdout = stdout
+
+
+@contextmanager
+def output_group() -> Iterator[None]:
+    _local.buffer = io.StringIO()
+    try:
+        yield
+    finally:
+        with _interaction_lock:
+            # Interactions replace the buffer, so we can't hold on to it
+            buffer = _group_buffer()
+            _local.buffer = None
+            if buffer is not None:
+                sys.stdout.write(buffer.getvalue())
+                sys.stdout.flush()
+
+
+@contextmanager
+def interaction() -> Iterator[None]:
+    """
+    Give the current thread exclusive access to the terminal, for example to
+    ask the user a question. Output buffered in the current output group is
+    printed first, so the user sees everything leading up to the interaction.
+    """
+    with _interaction_lock:
+        buffer = _group_buffer()
+        if buffer is None:
+            yield
+            return
+
+        _local.buffer = None
+        sys.stdout.write(buffer.getvalue())
+        sys.stdout.flush()
+        try:
+            yield
+        finally:
+            _local.buffer = io.StringIO()
+
+
+def _run(cmd: tuple[str, ...], **kwargs: Any) -> subprocess.CompletedProcess[Any]:
+    with span(shlex.join(cmd), "subprocess") as info:
+        result = subprocess.run(cmd, **kwargs)
+        info["returncode"] = result.returncode
+    return result
+
+
+def run_execute(*cmd: str, interactive: bool = True) -> None:
+    if interactive:
+        with interaction():
+            print(f"[bright_black]$ {escape(shlex.join(cmd))}")
+            _run(cmd).check_returncode()
+        return
 
-def run_execute(*cmd: str) -> None:
     print(f"[bright_black]$ {escape(shlex.join(cmd))}")
-    subprocess.run(cmd, check=True)
+    if _group_buffer() is None:
+        _run(cmd).check_returncode()
+        return
+
+    # The command's output must go through the output group
+    result = _run(
+        cmd,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+        encoding="utf-8",
+        errors="replace",
+    )
+    sys.stdout.write(result.stdout)
+    result.check_returncode()
 
 
 def run_capture(*cmd: str) -> str:
     print(f"[bright_black]$ {escape(shlex.join(cmd))}")
-    result = subprocess.run(cmd, check=True, capture_output=True, encoding="utf-8")
+    result = _run(cmd, capture_output=True, encoding="utf-8")
+    result.check_returncode()
     return result.stdout
 
 
 def fmt_diff(old: str, new: str, old_name="old", new_name="new") -> Syntax:
+    # Only needed when files changed, and pygments is slow to import
+    import difflib
+
+    from rich.syntax import Syntax
+
     diff_text = "".join(
         difflib.unified_diff(
             old.splitlines(keepends=True),
@@ -33,12 +156,13 @@ def fmt_diff(old: str, new: str, old_name="old", new_name="new") -> Syntax:
 
 def prompt(question: str, default: bool | None = None) -> bool:
     default_str = {True: "[Y/n]", False: "[y/N]", None: "[y/n]"}[default]
-    while True:
-        reply = input(f"{question} {default_str} ").strip().lower()
-        if not reply and default is not None:
-            return default
-        if reply in {"y", "yes"}:
-            return True
-        if reply in {"n", "no"}:
-            return False
-        print("Please enter y/yes or n/no.")
+    with interaction():
+        while True:
+            reply = input(f"{question} {default_str} ").strip().lower()
+            if not reply and default is not None:
+                return default
+            if reply in {"y", "yes"}:
+                return True
+            if reply in {"n", "no"}:
+                return False
+            print("Please enter y/yes or n/no.")
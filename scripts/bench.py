@@ -0,0 +1,256 @@
+#!/usr/bin/env python3
+"""
+Benchmarks for the file rendering and syncing hot paths.
+
+    uv run scripts/bench.py                      # print results as json
+    uv run scripts/bench.py -o baseline.json     # save results
+    uv run scripts/bench.py -c baseline.json     # compare against saved results
+
+Files benchmarks run against a temporary root, on tmpfs if `/dev/shm` exists,
+with the state dir redirected there as well.
+"""
+
+import atexit
+import contextlib
+import io
+import json
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from argparse import ArgumentParser
+from collections.abc import Callable
+from pathlib import Path
+from typing import Any
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from pasch.file import GitFile, JsonFile, TextFile, TomlFile
+from pasch.modules.files import Files
+from pasch.modules.pacman import Pacman, PackageResolver
+from pasch.orchestrator import Orchestrator
+
+type Result = dict[str, Any]
+
+
+def timeit(func: Callable[[], Any], runs: int) -> Result:
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return {"runs": runs, "min_s": min(times), "median_s": statistics.median(times)}
+
+
+def tmp_dir() -> Path:
+    shm = Path("/dev/shm")
+    path = tempfile.mkdtemp(prefix="pasch-bench-", dir=shm if shm.is_dir() else None)
+    atexit.register(shutil.rmtree, path, ignore_errors=True)
+    return Path(path)
+
+
+def bench_text(lines: int) -> Callable[[], Any]:
+    def run() -> bytes:
+        file = TextFile()
+        file.tag(comment="#")
+        for i in range(lines):
+            file.append(f"abbr a{i} 'command number {i}'")
+        return file.to_bytes()
+
+    return run
+
+
+def deep_tree(depth: int, width: int) -> Any:
+    if depth == 0:
+        return 42
+    return {f"key{i}": deep_tree(depth - 1, width) for i in range(width)}
+
+
+def bench_json(depth: int, width: int, merges: int) -> Callable[[], Any]:
+    def run() -> bytes:
+        file = JsonFile(deep_tree(depth, width))
+        for i in range(merges):
+            path = tuple(f"key{(i + j) % width}" for j in range(depth // 2))
+            file.merge(path, deep_tree(depth // 2, width))
+            file.set((*path, f"extra{i}"), i)
+        return file.to_bytes()
+
+    return run
+
+
+def bench_toml(depth: int, width: int) -> Callable[[], Any]:
+    data = deep_tree(depth, width)
+
+    def run() -> bytes:
+        file = TomlFile({})
+        file.set(("root",), data)
+        return file.to_bytes()
+
+    return run
+
+
+def bench_git(sections: int, values: int) -> Callable[[], Any]:
+    def run() -> bytes:
+        file = GitFile({})
+        for s in range(sections):
+            for v in range(values):
+                file.set(("section", f'sub "{s}"'), f"name{v}", f"value\t{v}\\")
+        return file.to_bytes()
+
+    return run
+
+
+def files_orchestrator(root: Path, count: int, variant: int = 0) -> Orchestrator:
+    o = Orchestrator(name="pasch-bench")
+    o.c.quiet = True
+    files = Files(o, root=root / "home")
+    for i in range(count):
+        file = TextFile()
+        # The variant only changes the first file
+        file.append(f"file {i} {variant}" if i == 0 else f"file {i}")
+        files.add(f"dir{i % 100}/file{i}", file)
+    return o
+
+
+def bench_files(count: int, runs: int) -> dict[str, Result]:
+    root = tmp_dir()
+    os.environ["XDG_STATE_HOME"] = str(root / "state")
+    db = root / "state" / "pasch-bench" / "files.json"
+
+    results = {}
+
+    def cold() -> None:
+        shutil.rmtree(root / "home", ignore_errors=True)
+        shutil.rmtree(root / "state", ignore_errors=True)
+        files_orchestrator(root, count).realize()
+
+    results[f"files_{count}_cold"] = timeit(cold, runs)
+    results[f"files_{count}_cold"]["db_bytes"] = db.stat().st_size
+
+    def noop() -> None:
+        files_orchestrator(root, count).realize(force=True)
+
+    results[f"files_{count}_noop"] = timeit(noop, runs)
+    results[f"files_{count}_noop"]["db_bytes"] = db.stat().st_size
+
+    def up_to_date() -> None:
+        files_orchestrator(root, count).realize()
+
+    results[f"files_{count}_up_to_date"] = timeit(up_to_date, runs)
+
+    variant = 0
+
+    def one_changed() -> None:
+        nonlocal variant
+        variant += 1
+        files_orchestrator(root, count, variant).realize()
+
+    results[f"files_{count}_one_changed"] = timeit(one_changed, runs)
+    return results
+
+
+def synthetic_groups(groups: int, size: int) -> dict[str, set[str]]:
+    result = {}
+    for g in range(groups):
+        members = {f"pkg{g}-{i}" for i in range(size)}
+        # Nest some groups into each other
+        if g > 0:
+            members.add(f"group{g // 2}")
+        result[f"group{g}"] = members
+    return result
+
+
+def bench_resolver(groups: int, size: int) -> Callable[[], Any]:
+    graph = synthetic_groups(groups, size)
+
+    def run() -> set[str]:
+        return PackageResolver(graph, {}).resolve(set(graph))
+
+    return run
+
+
+def bench_pacman(groups: int, size: int) -> Callable[[], Any]:
+    root = tmp_dir()
+    os.environ["XDG_STATE_HOME"] = str(root / "state")
+    output = root / "groups.txt"
+    with open(output, "w") as f:
+        for group, members in synthetic_groups(groups, size).items():
+            for member in sorted(members):
+                f.write(f"{group} {member}\n")
+    stub = root / "pacman"
+    stub.write_text(f"#!/bin/sh\ncat {output}\n")
+    stub.chmod(0o755)
+
+    def run() -> set[str]:
+        o = Orchestrator(name="pasch-bench")
+        pacman = Pacman(o)
+        pacman.binary = str(stub)
+        pacman.read_db = False
+        pacman.install(*(f"group{g}" for g in range(groups)))
+        return pacman.resolve().packages
+
+    return run
+
+
+def run_benchmarks(quick: bool) -> dict[str, Result]:
+    results: dict[str, Result] = {}
+    with contextlib.redirect_stdout(io.StringIO()):
+        results["text_10k_lines"] = timeit(bench_text(10_000), 10)
+        results["json_deep_merge"] = timeit(bench_json(6, 4, 200), 5)
+        results["toml_serialize"] = timeit(bench_toml(5, 5), 5)
+        results["git_serialize"] = timeit(bench_git(200, 20), 5)
+        results["pacman_resolve"] = timeit(bench_resolver(2000, 50), 5)
+        results["pacman_resolve_stub"] = timeit(bench_pacman(2000, 50), 3)
+        for count in (10, 1000) if quick else (10, 1000, 10_000):
+            results.update(bench_files(count, 3 if count > 1000 else 5))
+    return results
+
+
+def compare(
+    results: dict[str, Result], baseline: dict[str, Result], threshold: float
+) -> bool:
+    ok = True
+    print(f"{'benchmark':<28} {'baseline':>12} {'current':>12} {'ratio':>8}")
+    for name, result in results.items():
+        base = baseline.get(name)
+        if base is None:
+            print(f"{name:<28} {'-':>12} {result['min_s'] * 1000:>10.2f}ms {'new':>8}")
+            continue
+        ratio = result["min_s"] / base["min_s"]
+        marker = ""
+        if ratio > threshold:
+            marker = "  REGRESSION"
+            ok = False
+        print(
+            f"{name:<28} {base['min_s'] * 1000:>10.2f}ms "
+            f"{result['min_s'] * 1000:>10.2f}ms {ratio:>7.2f}x{marker}"
+        )
+    return ok
+
+
+def main() -> None:
+    parser = ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("-o", "--output", type=Path, help="save results to this file")
+    parser.add_argument("-c", "--compare", type=Path, help="compare against a baseline")
+    parser.add_argument("-t", "--threshold", type=float, default=1.25)
+    parser.add_argument(
+        "-q", "--quick", action="store_true", help="skip the largest cases"
+    )
+    args = parser.parse_args()
+
+    results = run_benchmarks(args.quick)
+
+    if args.output:
+        args.output.write_text(json.dumps(results, indent=2) + "\n")
+    if args.compare:
+        baseline = json.loads(args.compare.read_text())
+        if not compare(results, baseline, args.threshold):
+            sys.exit(1)
+    elif not args.output:
+        print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,38 @@
+import subprocess
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+
+CONFIG = """
+from pasch.file import TextFile
+from pasch.modules import Files
+
+
+def config(o):
+    Files(o, root=o.state_dir / "root").add("a", TextFile("a\\n"))
+"""
+
+
+class CmdTest(unittest.TestCase):
+    def pasch(self, *args: str) -> subprocess.CompletedProcess[str]:
+        dir = Path(tempfile.mkdtemp())
+        config = dir / "config.py"
+        config.write_text(CONFIG)
+        return subprocess.run(
+            [sys.executable, "-m", "pasch.cmd", *args, "-c", str(config)],
+            capture_output=True,
+            text=True,
+            env={"XDG_STATE_HOME": str(dir / "state"), "PATH": ""},
+        )
+
+    def test_status(self) -> None:
+        result = self.pasch("status", "--only", "files")
+        self.assertEqual(result.returncode, 1, result.stderr)
+        self.assertIn("Files: 1 change", result.stdout)
+
+    def test_unknown_module(self) -> None:
+        result = self.pasch("status", "--only", "files", "--only", "nope")
+        self.assertEqual(result.returncode, 2)
+        self.assertIn("--only: unknown modules nope", result.stderr)
+        self.assertNotIn("Traceback", result.stderr)
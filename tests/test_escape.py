@@ -0,0 +1,79 @@
+import random
+import unittest
+from collections.abc import Callable
+
+from pasch.file.git import _format_header, _format_name, _format_value
+from pasch.modules.fish import escape as fish_escape
+
+# The implementations before `pasch.escape`, which the new ones must match
+# byte for byte
+
+
+def old_fish_escape(s: str) -> str:
+    ESCAPES = {"'": "\\'", "\\": "\\\\"}
+    escaped = "".join(ESCAPES.get(c, c) for c in s)
+    return f"'{escaped}'"
+
+
+def old_format_header(section: str | tuple[str, str]) -> str:
+    if isinstance(section, str):
+        title, subsection = section, None
+    else:
+        title, subsection = section
+
+    assert title
+    assert all(c.isascii() and (c.isalnum() or c == "-") for c in title)
+    section = title.lower()
+
+    if subsection is None:
+        return f"[{section}]"
+
+    assert subsection
+    for c in subsection:
+        assert c not in {"\n", "\0"}
+
+    escaped = "".join({'"': '\\"', "\\": "\\\\"}.get(c, c) for c in subsection)
+    return f'[{section} "{escaped}"]'
+
+
+def old_format_name(name: str) -> str:
+    assert name
+    assert all(c.isascii() and (c.isalnum() or c == "-") for c in name)
+    assert name[0].isalpha()
+
+    return name
+
+
+def old_format_value(value: str) -> str:
+    escapes = {'"': '\\"', "\\": "\\\\", "\n": "\\n", "\t": "\\t", "\b": "\\b"}
+    escaped = "".join(escapes.get(c, c) for c in value)
+    return f'"{escaped}"'
+
+
+# Characters that are escaped or rejected by some of the functions, and
+# non-ASCII letters and digits, which `str.isalnum()` accepts
+ALPHABET = "azAZ09-._ '\"\\\n\t\b\0\r\x7f$`\u00a0\u200béßÄǅΩж٣²ⅷ一🙂"
+
+
+def outcome(f: Callable[..., str], *args: object) -> str | None:
+    try:
+        return f(*args)
+    except AssertionError:
+        return None
+
+
+class EscapeTest(unittest.TestCase):
+    def test_identical_to_old_functions(self) -> None:
+        rng = random.Random(0)
+        for _ in range(100_000):
+            s = "".join(rng.choices(ALPHABET, k=rng.randrange(8)))
+            t = "".join(rng.choices(ALPHABET, k=rng.randrange(8)))
+            cases = [
+                (fish_escape, old_fish_escape, (s,)),
+                (_format_header, old_format_header, (s,)),
+                (_format_header, old_format_header, ((s, t),)),
+                (_format_name, old_format_name, (s,)),
+                (_format_value, old_format_value, (s,)),
+            ]
+            for new, old, args in cases:
+                self.assertEqual(outcome(new, *args), outcome(old, *args), args)
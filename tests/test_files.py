@@ -0,0 +1,164 @@
+import json
+import tempfile
+import unittest
+import os
+from pathlib import Path
+from typing import Any
+
+from pasch import Orchestrator
+from pasch.file import File, JsonFile, TextFile
+from pasch.modules.files import FileDb, Files
+
+
+class FileDbTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.dir = Path(tempfile.mkdtemp())
+        self.path = self.dir / "files.json"
+        self.journal = self.dir / "files.json.journal"
+
+    def test_replay_after_crash(self) -> None:
+        db = FileDb(self.path)
+        db.add_hash(self.dir / "a", "sha256-a")
+        db.add_hash(self.dir / "b", "sha256-b")
+        db.remove_hash(self.dir / "a")
+        # No commit, as if pasch crashed
+        self.assertFalse(self.path.exists())
+        self.assertTrue(self.journal.exists())
+
+        db = FileDb(self.path)
+        self.assertIsNone(db.get_hash(self.dir / "a"))
+        self.assertEqual(db.get_hash(self.dir / "b"), "sha256-b")
+
+    def test_torn_last_line(self) -> None:
+        db = FileDb(self.path)
+        db.add_hash(self.dir / "a", "sha256-a")
+        with open(self.journal, "a", encoding="utf-8") as f:
+            f.write('["' + str(self.dir / "b"))
+
+        db = FileDb(self.path)
+        self.assertEqual(db.paths(), [str(self.dir / "a")])
+
+    def test_commit(self) -> None:
+        db = FileDb(self.path)
+        db.add_hash(self.dir / "a", "sha256-a", (1, 2, 3))
+        db.commit()
+        self.assertFalse(self.journal.exists())
+        data = json.loads(self.path.read_text(encoding="utf-8"))
+        self.assertEqual(
+            data, {str(self.dir / "a"): {"hash": "sha256-a", "stat": [1, 2, 3]}}
+        )
+
+        db = FileDb(self.path)
+        self.assertEqual(db.known_hash(self.dir / "a", (1, 2, 3)), "sha256-a")
+        self.assertIsNone(db.known_hash(self.dir / "a", (1, 2, 4)))
+
+    def test_unchanged_entries_are_not_journaled(self) -> None:
+        db = FileDb(self.path)
+        db.add_hash(self.dir / "a", "sha256-a")
+        db.commit()
+        db.add_hash(self.dir / "a", "sha256-a")
+        self.assertFalse(self.journal.exists())
+
+    def test_checkpoint_every(self) -> None:
+        db = FileDb(self.path, checkpoint_every=2)
+        db.add_hash(self.dir / "a", "sha256-a")
+        self.assertFalse(self.path.exists())
+        db.add_hash(self.dir / "b", "sha256-b")
+        self.assertTrue(self.path.exists())
+        self.assertFalse(self.journal.exists())
+        db.add_hash(self.dir / "c", "sha256-c")
+        self.assertTrue(self.journal.exists())
+
+        db = FileDb(self.path)
+        self.assertEqual(len(db.paths()), 3)
+
+
+class FilesHistoryTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.dir = Path(tempfile.mkdtemp())
+        self.home = self.dir / "home"
+
+    def run_files(self, contents: dict[str, str], **kwargs: Any) -> Files:
+        o = Orchestrator(state_dir=self.dir / "state", interactive=False)
+        o.c.quiet = True
+        files = Files(o, root=self.home, **kwargs)
+        files.c.quiet = True
+        for name, text in contents.items():
+            # Json files have fingerprints, so their hashes are cached
+            file: File = JsonFile({"text": text})
+            if not name.endswith(".json"):
+                file = TextFile(text)
+                file.executable = name.endswith(".sh")
+            files.add(name, file)
+        o.realize()
+        return files
+
+    def objects(self) -> int:
+        return sum(len(files) for _, _, files in os.walk(self.dir / "state/objects"))
+
+    def test_rollback(self) -> None:
+        self.run_files({"a": "one\n", "x.sh": "echo\n"})
+        self.run_files({"a": "two\n", "b": "bee\n"})
+        files = self.run_files({"b": "bee2\n"})
+        self.assertEqual([g.id for g in files.generations()], [1, 2, 3])
+        self.assertEqual(sorted(os.listdir(self.home)), ["b"])
+
+        files.rollback(1)
+        self.assertTrue(files.converged())
+        self.assertEqual(sorted(os.listdir(self.home)), ["a", "x.sh"])
+        self.assertEqual((self.home / "a").read_text(), "one\n")
+        self.assertTrue(os.access(self.home / "x.sh", os.X_OK))
+
+        # The rollback is a generation of its own, which can be undone
+        gen = files.generations()[-1]
+        self.assertEqual(gen.id, 4)
+        files.rollback(3)
+        self.assertEqual((self.home / "b").read_text(), "bee2\n")
+
+    def test_user_changes_are_kept(self) -> None:
+        self.run_files({"a": "one\n"})
+        (self.home / "a").write_text("user\n")
+        # The user's change is only overwritten after confirming, which a
+        # non-interactive run can't
+        files = self.run_files({"a": "two\n"})
+        self.assertFalse(files.converged())
+        self.assertEqual((self.home / "a").read_text(), "user\n")
+
+        os.remove(self.home / "a")
+        files = self.run_files({"a": "two\n"})
+        self.assertEqual((self.home / "a").read_text(), "two\n")
+        files.rollback(1)
+        self.assertEqual((self.home / "a").read_text(), "one\n")
+
+    def test_prune(self) -> None:
+        for i in range(5):
+            files = self.run_files({"a": f"{i}\n"}, history=2)
+        self.assertEqual([g.id for g in files.generations()], [4, 5])
+        # The contents of the last two generations and those they replaced
+        self.assertEqual(self.objects(), 3)
+        with self.assertRaises(ValueError):
+            files.rollback(1)
+
+        files.rollback(4)
+        self.assertEqual((self.home / "a").read_text(), "3\n")
+
+    def test_no_history(self) -> None:
+        for i in range(3):
+            files = self.run_files({"a": f"{i}\n"}, history=0)
+        self.assertEqual(files.generations(), [])
+        self.assertEqual(self.objects(), 0)
+
+    def test_render_cache_keeps_skipped_files(self) -> None:
+        cache = self.dir / "state/render-cache.json"
+        self.run_files({"a.json": "a", "b.json": "b"})
+        first = json.loads(cache.read_text())
+        self.assertEqual(len(first), 2)
+
+        # Only b is rendered, but a is still managed
+        self.run_files({"a.json": "a", "b.json": "changed"})
+        second = json.loads(cache.read_text())
+        self.assertEqual(len(second), 2)
+        self.assertEqual(len(first.items() & second.items()), 1)
+
+        self.run_files({"b.json": "changed"})
+        self.assertEqual(len(json.loads(cache.read_text())), 1)
@@ -0,0 +1,55 @@
+import getpass
+import tempfile
+import unittest
+from pathlib import Path
+
+from pasch.file import TextFile
+from pasch.fleet import Fleet, Host
+from pasch.orchestrator import Orchestrator
+from pasch.transport import ChrootTransport
+from pasch.modules import Files
+
+
+def config(o: Orchestrator) -> None:
+    files = Files(o)
+    files.add("shared.txt", TextFile("shared\n"))
+    files.add("host.txt", TextFile(f"{o.host}\n"))
+
+
+class FleetTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.dir = Path(tempfile.mkdtemp())
+        self.hosts = []
+        for name in ["a", "b"]:
+            root = self.dir / name
+            (root / "etc").mkdir(parents=True)
+            user = getpass.getuser()
+            passwd = f"{user}:x:1000:1000::/home/{user}:/bin/sh\n"
+            (root / "etc/passwd").write_text(passwd)
+            self.hosts.append(Host(name, ChrootTransport(root)))
+
+    def fleet(self) -> Fleet:
+        fleet = Fleet(config, self.hosts, jobs=2, state_dir=self.dir / "state")
+        fleet.c.quiet = True
+        return fleet
+
+    def test_realize(self) -> None:
+        self.assertTrue(self.fleet().realize())
+        for host in self.hosts:
+            home = self.dir / host.name / "home" / getpass.getuser()
+            self.assertEqual((home / "host.txt").read_text(), f"{host.name}\n")
+            self.assertEqual((home / "shared.txt").read_text(), "shared\n")
+
+    def test_artifacts_are_removed(self) -> None:
+        fleet = self.fleet()
+        plans = fleet.plan()
+        # One artifact per host and one shared by both
+        self.assertEqual(len(fleet.store.hashes()), 3)
+
+        # Plans that are never applied are cleaned up by the next plan
+        fleet.store.put(b"left over\n")
+        plans = fleet.plan()
+        self.assertEqual(len(fleet.store.hashes()), 3)
+
+        fleet.apply(plans)
+        self.assertEqual(fleet.store.hashes(), set())
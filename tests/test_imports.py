@@ -0,0 +1,41 @@
+import json
+import subprocess
+import sys
+import unittest
+from pathlib import Path
+
+ROOT = Path(__file__).parent.parent
+
+# Slow to import, and only needed once they are actually used
+DEFERRED = {"asyncio", "difflib", "rich.syntax", "toml", "tomllib"}
+
+
+def imported_modules(code: str) -> set[str]:
+    """
+    The modules imported after running the given code in a new interpreter.
+    """
+    code += "\nimport json, sys\nprint(json.dumps(sorted(sys.modules)))"
+    output = subprocess.run(
+        [sys.executable, "-c", code],
+        cwd=ROOT,
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout
+    return set(json.loads(output.splitlines()[-1]))
+
+
+class ImportTest(unittest.TestCase):
+    def test_import_pasch(self) -> None:
+        modules = imported_modules("import pasch")
+        unwanted = DEFERRED | {"rich", "pasch.file", "pasch.modules"}
+        self.assertEqual(modules & unwanted, set())
+
+    def test_import_config(self) -> None:
+        modules = imported_modules(
+            "from pasch import Orchestrator\n"
+            "from pasch.file import JsonFile, TextFile\n"
+            "from pasch.modules import Files, Pacman\n"
+        )
+        unwanted = DEFERRED | {"pasch.file.toml", "pasch.modules.vscode"}
+        self.assertEqual(modules & unwanted, set())
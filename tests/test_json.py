@@ -0,0 +1,43 @@
+import unittest
+
+from pasch.file import JsonFile
+
+
+class JsonFileTest(unittest.TestCase):
+    def test_set_creates_missing_dicts(self) -> None:
+        file = JsonFile()
+        file.set(("a", "b", "c"), 1)
+        file.at("a").merge("d", {"e": 2})
+        self.assertEqual(file.data, {"a": {"b": {"c": 1}, "d": {"e": 2}}})
+
+    def test_layers_are_not_modified(self) -> None:
+        base = {"a": {"b": 1}}
+        value = {"c": 2}
+        file = JsonFile(base)
+        file.merge("a", value)
+        file.set(("a", "d", "e"), 3)
+        self.assertEqual(file.data, {"a": {"b": 1, "c": 2, "d": {"e": 3}}})
+        self.assertEqual(base, {"a": {"b": 1}})
+        self.assertEqual(value, {"c": 2})
+
+    def test_set_through_non_dict(self) -> None:
+        file = JsonFile({"a": [1, 2]})
+        file.set(("a", "b"), 1)
+        with self.assertRaisesRegex(TypeError, "cannot set a.b, a has type list"):
+            file.data
+
+        file = JsonFile({"a": {"b": None}})
+        file.merge(("a", "b", "c"), {})
+        with self.assertRaisesRegex(TypeError, "a.b has type NoneType"):
+            file.data
+
+        file = JsonFile([])
+        file.set("a", 1)
+        with self.assertRaisesRegex(TypeError, "the root has type list"):
+            file.data
+
+    def test_replace_non_dict(self) -> None:
+        file = JsonFile({"a": [1, 2]})
+        file.set("a", {})
+        file.set(("a", "b"), 1)
+        self.assertEqual(file.data, {"a": {"b": 1}})
@@ -0,0 +1,157 @@
+import tempfile
+import unittest
+from pathlib import Path
+from typing import Any
+
+from pasch import Module, Orchestrator, module, module_gen
+from pasch.file import TextFile
+from pasch.modules import Echo, Files
+
+
+@module_gen
+def theme(o: Orchestrator):
+    return {"background": "#1e1e2e"}
+    yield
+
+
+@module_gen
+def terminal(o: Orchestrator, files: Files, theme: Module):
+    colors = yield theme
+    files.add("terminal.ini", TextFile(f"background = {colors['background']}\n"))
+
+
+@module_gen
+def editor(o: Orchestrator, files: Files, theme: Module):
+    colors = yield theme
+    files.add("editor.ini", TextFile(f"background = {colors['background']}\n"))
+
+
+@module_gen
+def unused(o: Orchestrator, log: list[str]):
+    log.append("unused")
+    return
+    yield
+
+
+@module
+def plain(o: Orchestrator, log: list[str]):
+    log.append("plain")
+
+
+class Recorder(Module):
+    """
+    Records its executions, and observes a value the test controls.
+    """
+
+    def __init__(self, o: Orchestrator, log: list[str], name: str) -> None:
+        super().__init__(o)
+        self.log = log
+        self.name = name
+        self.setting = 1
+        self.system: Any = "ok"
+        self.after: Module | None = None
+
+    def inputs(self) -> Any:
+        return self.setting
+
+    def observe(self) -> Any:
+        return self.system
+
+    def apply(self, plan: Any) -> None:
+        self.log.append(self.name)
+
+
+class OrchestratorTest(unittest.TestCase):
+    def orchestrator(self, **kwargs: Any) -> Orchestrator:
+        state_dir = Path(tempfile.mkdtemp())
+        o = Orchestrator(state_dir=state_dir, dry_run=True, **kwargs)
+        o.c.quiet = True
+        return o
+
+    def test_configure_on_demand(self) -> None:
+        o = self.orchestrator()
+        log: list[str] = []
+        unused(o, log)
+        plain(o, log)
+        o.configure()
+        self.assertEqual(log, ["plain"])
+
+    def test_two_consumers_of_one_module(self) -> None:
+        o = self.orchestrator()
+        root = Path(tempfile.mkdtemp())
+        files = Files(o, root=root)
+        t = theme(o)
+        terminal(o, files, t)
+        editor(o, files, t)
+        o.configure()
+        self.assertEqual(
+            sorted(files._files), [str(root / "editor.ini"), str(root / "terminal.ini")]
+        )
+
+    def test_echo_always_runs(self) -> None:
+        o = Orchestrator(state_dir=Path(tempfile.mkdtemp()), interactive=False)
+        o.c.quiet = True
+        echo = Echo(o)
+        echo.add("hello")
+        o.realize()
+        self.assertTrue((o.state_dir / "state.json").exists())
+        self.assertEqual(o.outdated(), [echo])
+        self.assertEqual(echo.changes(echo.plan()), ["echo hello"])
+
+
+class SelectiveExecutionTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.state_dir = Path(tempfile.mkdtemp())
+        self.log: list[str] = []
+
+    def realize(
+        self, force: bool, only: list[str] | None, **settings: Any
+    ) -> Orchestrator:
+        o = Orchestrator(state_dir=self.state_dir, interactive=False, only=only)
+        o.c.quiet = True
+        modules = {name: Recorder(o, self.log, name) for name in ["a", "b", "c"]}
+        # c builds on b
+        modules["c"].after = modules["b"]
+        for name, (setting, system) in settings.items():
+            modules[name].setting = setting
+            modules[name].system = system
+        o.realize(force=force)
+        return o
+
+    def executed(
+        self, force: bool = False, only: list[str] | None = None, **settings: Any
+    ) -> list[str]:
+        self.log.clear()
+        self.realize(force, only, **settings)
+        return sorted(self.log)
+
+    def test_only_outdated_modules_run(self) -> None:
+        self.assertEqual(self.executed(), ["a", "b", "c"])
+        self.assertEqual(self.executed(), [])
+        # Config changed
+        self.assertEqual(self.executed(a=(2, "ok")), ["a"])
+        # System changed
+        self.assertEqual(self.executed(a=(2, "drift")), ["a"])
+        self.assertEqual(self.executed(a=(2, "drift")), [])
+
+    def test_dependents_run(self) -> None:
+        self.executed()
+        self.assertEqual(self.executed(b=(2, "ok")), ["b", "c"])
+        self.assertEqual(self.executed(c=(2, "ok"), b=(2, "ok")), ["c"])
+
+    def test_force(self) -> None:
+        self.executed()
+        self.assertEqual(self.executed(force=True), ["a", "b", "c"])
+
+    def test_unobservable_modules_always_run(self) -> None:
+        self.executed()
+        self.assertEqual(self.executed(a=(1, None)), ["a"])
+        self.assertEqual(self.executed(a=(1, None)), ["a"])
+
+    def test_only_keeps_other_fingerprints(self) -> None:
+        self.executed()
+        self.assertEqual(
+            self.executed(only=["Recorder#2"], a=(2, "ok"), b=(2, "ok")), ["b"]
+        )
+        # The change to a wasn't handled yet
+        self.assertEqual(self.executed(a=(2, "ok"), b=(2, "ok")), ["a"])
@@ -0,0 +1,142 @@
+import contextlib
+import io
+import tarfile
+import tempfile
+import unittest
+from pathlib import Path
+
+from pasch.modules.pacman import PackageResolver, Pacman
+from pasch.orchestrator import Orchestrator
+
+
+def desc(name: str, reason: int | None = None, **sections: list[str]) -> str:
+    text = f"%NAME%\n{name}\n\n%VERSION%\n1-1\n\n"
+    if reason is not None:
+        text += f"%REASON%\n{reason}\n\n"
+    for section, values in sections.items():
+        text += f"%{section.upper()}%\n" + "".join(f"{v}\n" for v in values) + "\n"
+    return text
+
+
+def make_root(root: Path) -> None:
+    """
+    A pacman database with local packages and a sync database.
+    """
+    local = root / "var/lib/pacman/local"
+    packages = [
+        desc("git", depends=["less", "libgit>=2"]),
+        desc("libgit", reason=1),
+        desc("less", reason=0),
+        desc("fish", reason=1),
+        desc("old", reason=0),
+        desc("orphan", reason=1),
+    ]
+    for text in packages:
+        name = text.split("\n")[1]
+        (local / f"{name}-1-1").mkdir(parents=True)
+        (local / f"{name}-1-1/desc").write_text(text)
+    (local / "ALPM_DB_VERSION").write_text("9\n")
+
+    sync = root / "var/lib/pacman/sync"
+    sync.mkdir(parents=True)
+    with tarfile.open(sync / "core.db", "w:gz") as tar:
+        for name, groups in [("a", ["grp"]), ("b", ["grp"]), ("git", [])]:
+            data = desc(name, groups=groups).encode("utf-8")
+            info = tarfile.TarInfo(f"{name}-1-1/desc")
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+
+
+class PackageResolverTest(unittest.TestCase):
+    def test_nested_groups(self) -> None:
+        resolver = PackageResolver({"A": {"B", "a"}, "B": {"b"}}, {"A": {"a"}})
+        self.assertEqual(resolver.resolve({"A", "c"}), {"b", "c"})
+        self.assertEqual(resolver.why("b"), ["A", "B", "b"])
+
+    def test_group_containing_itself(self) -> None:
+        resolver = PackageResolver({"A": {"A", "a"}}, {})
+        self.assertEqual(resolver.resolve({"A"}), {"A", "a"})
+        self.assertEqual(resolver.cycles, [])
+
+    def test_cycle(self) -> None:
+        groups = {"A": {"B", "a"}, "B": {"A", "b"}}
+        for names in ({"A", "B"}, {"A"}, {"B"}):
+            resolver = PackageResolver(groups, {})
+            self.assertEqual(resolver.resolve(names), {"a", "b"})
+            self.assertEqual(len(resolver.cycles), 1)
+
+    def test_groups_inside_cycle_are_complete(self) -> None:
+        groups = {"A": {"B"}, "B": {"C", "b"}, "C": {"B", "A", "c"}}
+        resolver = PackageResolver(groups, {})
+        resolver.resolve({"A"})
+        for name in ("A", "B", "C"):
+            self.assertEqual(resolver._resolve(name), {"b", "c"})
+
+    def test_dense_cycles(self) -> None:
+        # Every group contains every other group, which is a single cycle
+        names = [f"G{i}" for i in range(50)]
+        groups = {name: {*names, name.lower()} - {name} for name in names}
+        resolver = PackageResolver(groups, {})
+        packages = {name.lower() for name in names}
+        self.assertEqual(resolver.resolve(set(names)), packages)
+        self.assertEqual(resolver.cycles, [tuple(sorted(names))])
+
+
+class PacmanTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.dir = Path(tempfile.mkdtemp())
+        make_root(self.dir / "root")
+
+        # Records its arguments instead of changing anything
+        self.log = self.dir / "pacman.log"
+        self.binary = self.dir / "pacman"
+        self.binary.write_text(f'#!/bin/sh\necho "$*" >> {self.log}\n')
+        self.binary.chmod(0o755)
+
+    def pacman(self, o: Orchestrator) -> Pacman:
+        o.c.quiet = True
+        pacman = Pacman(o)
+        pacman.root = self.dir / "root"
+        pacman.binary = str(self.binary)
+        pacman.sudo = False
+        pacman.install("git", "fish", "grp")
+        pacman.exclude("grp", "b")
+        return pacman
+
+    def test_plan_from_db(self) -> None:
+        o = Orchestrator(state_dir=self.dir / "state", interactive=False)
+        self.pacman(o)
+        o.configure()
+        plan = o.plan().modules["Pacman"]
+
+        self.assertEqual(plan["install"], ["a", "fish"])
+        self.assertEqual(plan["uninstall"], ["less", "old"])
+        self.assertEqual(
+            plan["transactions"],
+            {
+                "install": ["a"],
+                "mark_explicit": ["fish"],
+                "mark_deps": ["less"],
+                "remove": ["old", "orphan"],
+            },
+        )
+        # Everything was read from the databases
+        self.assertFalse(self.log.exists())
+
+    def test_merged_transactions(self) -> None:
+        o = Orchestrator(state_dir=self.dir / "state", interactive=False)
+        self.pacman(o)
+        with contextlib.redirect_stdout(io.StringIO()):
+            o.realize()
+
+        invocations = self.log.read_text().splitlines()
+        self.assertEqual(
+            invocations,
+            [
+                "--noconfirm -S --needed --asexplicit a",
+                "--noconfirm -D --asexplicit fish",
+                "--noconfirm -D --asdeps less",
+                "--noconfirm -Rsn old orphan",
+            ],
+        )
+        self.assertLessEqual(len(invocations), 4)
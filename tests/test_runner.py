@@ -0,0 +1,79 @@
+import asyncio
+import contextlib
+import io
+import os
+import tempfile
+import time
+import unittest
+from pathlib import Path
+
+from pasch.runner import (
+    Backend,
+    Cmd,
+    CommandResult,
+    LineCallback,
+    RecordingBackend,
+    ReplayBackend,
+    Runner,
+    SubprocessBackend,
+)
+
+
+class FailingBackend(Backend):
+    """
+    Runs commands starting with `fail` as failing to start after a while, and
+    all others as subprocesses.
+    """
+
+    async def run(
+        self,
+        cmd: Cmd,
+        on_line: LineCallback,
+        timeout: float | None,
+    ) -> CommandResult:
+        if cmd[0] == "fail":
+            await asyncio.sleep(0.2)
+            raise FileNotFoundError(cmd[0])
+        return await SubprocessBackend().run(cmd, on_line, timeout)
+
+
+class RunnerTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.dir = Path(tempfile.mkdtemp())
+
+    def run_quietly(self, runner: Runner, *cmds: Cmd) -> list[CommandResult]:
+        with contextlib.redirect_stdout(io.StringIO()):
+            return runner.run(*cmds, check=False)
+
+    def test_record_and_replay(self) -> None:
+        cmds = [
+            ("sh", "-c", "echo out; echo err >&2; exit 3"),
+            ("echo", "hello"),
+            ("echo", "hello"),
+        ]
+        path = self.dir / "recording.jsonl"
+        recorded = self.run_quietly(Runner(backend=RecordingBackend(path)), *cmds)
+        self.assertEqual(recorded[0], CommandResult(cmds[0], 3, "out\n", "err\n"))
+        self.assertEqual(recorded[1].stdout, "hello\n")
+
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            replayed = Runner(backend=ReplayBackend(path)).run(*cmds, check=False)
+        self.assertEqual(replayed, recorded)
+        self.assertIn("sh | out", output.getvalue())
+        self.assertIn("sh | err", output.getvalue())
+
+        # Every recorded result is only replayed once
+        with self.assertRaises(Exception):
+            self.run_quietly(Runner(backend=ReplayBackend(path)), *cmds, cmds[1])
+
+    def test_kill_on_failure(self) -> None:
+        pid_path = self.dir / "pid"
+        sleep = ("sh", "-c", f'echo $$ > "{pid_path}"; exec sleep 30')
+        start = time.monotonic()
+        with self.assertRaises(FileNotFoundError):
+            self.run_quietly(Runner(backend=FailingBackend()), sleep, ("fail",))
+        self.assertLess(time.monotonic() - start, 10)
+
+        with self.assertRaises(ProcessLookupError):
+            os.kill(int(pid_path.read_text()), 0)
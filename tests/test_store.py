@@ -0,0 +1,89 @@
+import tempfile
+import unittest
+from pathlib import Path
+
+from pasch.file.file import hash_bytes
+from pasch.store import GenerationLog, ObjectStore
+
+
+class ObjectStoreTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.dir = Path(tempfile.mkdtemp())
+
+    def check_store(self, store: ObjectStore) -> None:
+        hash = store.put(b"contents\n")
+        self.assertEqual(hash, hash_bytes(b"contents\n"))
+        self.assertEqual(store.put(b"contents\n"), hash)
+        self.assertTrue(store.has(hash))
+        self.assertEqual(store.read(hash), b"contents\n")
+
+        path = self.dir / "file"
+        path.write_bytes(b"file\n")
+        file_hash = store.put_file(path)
+        self.assertEqual(file_hash, hash_bytes(b"file\n"))
+        self.assertIsNone(store.put_file(self.dir / "missing"))
+        self.assertEqual(store.hashes(), {hash, file_hash})
+
+        target = self.dir / "target"
+        target.write_bytes(b"old\n")
+        store.restore(hash, target)
+        self.assertEqual(target.read_bytes(), b"contents\n")
+
+        self.assertGreater(store.remove({hash}), 0)
+        self.assertFalse(store.has(hash))
+        self.assertEqual(store.remove({hash}), 0)
+        self.assertEqual(store.hashes(), {file_hash})
+
+    def test_plain(self) -> None:
+        self.check_store(ObjectStore(self.dir / "objects"))
+
+    def test_compressed(self) -> None:
+        store = ObjectStore(self.dir / "objects", compress=True)
+        self.check_store(store)
+        # Compressed objects are only readable through the store
+        hash = store.put(b"x" * 1000)
+        self.assertFalse(store.object_path(hash).exists())
+        self.assertEqual(store.read(hash), b"x" * 1000)
+
+    def test_invalid_hash(self) -> None:
+        store = ObjectStore(self.dir / "objects")
+        for hash in ["nodash", "sha256-../x", "../sha256-x"]:
+            with self.assertRaises(ValueError):
+                store.object_path(hash)
+
+
+class GenerationLogTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.log = GenerationLog(Path(tempfile.mkdtemp()) / "generations.jsonl")
+
+    def test_append(self) -> None:
+        self.assertIsNone(self.log.last())
+        first = self.log.append({"/a": "h-a1"}, ["/a"], {"/a": None})
+        second = self.log.append({"/a": "h-a2"}, [], {"/a": "h-a1"})
+        self.assertEqual((first.id, second.id), (1, 2))
+        self.assertEqual(self.log.last(), second)
+        self.assertEqual(self.log.get(1), first)
+        self.assertEqual(self.log.load(), [first, second])
+        with self.assertRaises(ValueError):
+            self.log.get(3)
+
+    def test_torn_write(self) -> None:
+        first = self.log.append({"/a": "h-a1"}, [], {})
+        with open(self.log.path, "a", encoding="utf-8") as f:
+            f.write('{"id": 2, "ti')
+        self.assertEqual(self.log.load(), [first])
+        self.assertEqual(self.log.last(), first)
+        self.assertEqual(self.log.append({}, [], {}).id, 2)
+
+    def test_prune(self) -> None:
+        self.log.append({"/a": "h-a1", "/b": "h-b"}, [], {"/a": None, "/b": None})
+        self.log.append({"/a": "h-a2", "/b": "h-b"}, [], {"/a": "h-a1"})
+        third = self.log.append({"/a": "h-a3", "/b": "h-b"}, [], {"/a": "h-a2"})
+
+        self.assertEqual(self.log.prune(3), set())
+        # h-a2 is still referenced as the contents the third generation replaced
+        self.assertEqual(self.log.prune(1), {"h-a1"})
+        self.assertEqual(self.log.load(), [third])
+
+        self.assertEqual(self.log.prune(0), {"h-a2", "h-a3", "h-b"})
+        self.assertFalse(self.log.path.exists())
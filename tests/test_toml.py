@@ -0,0 +1,87 @@
+import datetime
+import math
+import random
+import tomllib
+import unittest
+from typing import Any
+
+from pasch.file.toml import TomlFile
+
+# Includes characters that need escaping in strings and quoting in keys
+KEY_ALPHABET = "abzAZ09_- .\"'\\=[]#\n\t\0\x7féß🙂"
+STRING_ALPHABET = KEY_ALPHABET + "\b\f\r\x1f\u00a0\u2028"
+TIMEZONES = [None, datetime.UTC, datetime.timezone(datetime.timedelta(hours=-5.5))]
+
+
+class RandomData:
+    def __init__(self, seed: int) -> None:
+        self.rng = random.Random(seed)
+
+    def string(self, alphabet: str) -> str:
+        return "".join(self.rng.choices(alphabet, k=self.rng.randrange(6)))
+
+    def scalar(self) -> Any:
+        rng = self.rng
+        match rng.randrange(8):
+            case 0:
+                return rng.random() < 0.5
+            case 1:
+                return rng.randint(-(2**63), 2**63 - 1)
+            case 2:
+                return rng.choice([0.0, -0.0, 0.1, 1e16, 1e-5, math.inf, -math.inf])
+            case 3:
+                return rng.uniform(-1e6, 1e6)
+            case 4:
+                return datetime.date(rng.randint(1, 9999), 1 + rng.randrange(12), 28)
+            case 5:
+                return datetime.time(rng.randrange(24), 59, 0, rng.randrange(10**6))
+            case 6:
+                tz = rng.choice(TIMEZONES)
+                return datetime.datetime(2000, 2, 29, 12, 30, 15, tzinfo=tz)
+            case _:
+                return self.string(STRING_ALPHABET)
+
+    def value(self, depth: int, inline: bool) -> Any:
+        kind = self.rng.randrange(4 if depth > 0 else 1)
+        if kind == 1:
+            # Tables in arrays that aren't arrays of tables are inline tables
+            n = self.rng.randrange(4)
+            return [self.value(depth - 1, inline=True) for _ in range(n)]
+        if kind == 2:
+            return self.table(depth - 1, inline)
+        if kind == 3:
+            n = 1 + self.rng.randrange(3)
+            return [self.table(depth - 1, inline) for _ in range(n)]
+        return self.scalar()
+
+    def table(self, depth: int, inline: bool = False) -> dict[str, Any]:
+        table = {}
+        for _ in range(self.rng.randrange(5)):
+            key = self.string(KEY_ALPHABET)
+            # `None` values are left out, except in inline tables
+            if not inline and self.rng.random() < 0.1:
+                table[key] = None
+            else:
+                table[key] = self.value(depth, inline)
+        return table
+
+
+def without_none(value: Any) -> Any:
+    if isinstance(value, dict):
+        return {k: without_none(v) for k, v in value.items() if v is not None}
+    if isinstance(value, list):
+        return [without_none(v) for v in value]
+    return value
+
+
+class TomlTest(unittest.TestCase):
+    def test_round_trip(self) -> None:
+        for seed in range(2000):
+            data = RandomData(seed).table(depth=3)
+            text = TomlFile(data).to_bytes().decode("utf-8")
+            with self.subTest(seed=seed, text=text):
+                self.assertEqual(tomllib.loads(text), without_none(data))
+
+    def test_nan(self) -> None:
+        text = TomlFile({"a": math.nan}).to_bytes().decode("utf-8")
+        self.assertTrue(math.isnan(tomllib.loads(text)["a"]))